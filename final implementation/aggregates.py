@@ -0,0 +1,105 @@
+"""Single-pass aggregation of the exploratory review statistics.
+
+Instead of running a separate Spark job for the rating histogram, the review
+count, the per-product counts, the number of products and the positive and
+negative counts per product, build_report() scans the cleaned reviews once
+to build a per-product table that holds all of them. Everything else is
+derived from that (much smaller) table. The per-customer counts need a
+second grouping, which only runs when customer_reviews is first used.
+
+Nothing is cached here. A caller that reads the per-product or per-customer
+table more than once persists them itself, e.g. by registering them with
+the ExecutionPlanner, and builds the report from them with
+report_from_aggregates(), so the totals job already fills the cache.
+"""
+
+from dataclasses import dataclass
+
+import pyspark.sql.functions as F
+from pyspark.sql import DataFrame
+
+from common import STAR_RATINGS, POSITIVE_RATING, NEGATIVE_RATING
+from profiling import to_driver
+from skew import salted_aggregate
+
+
+def count_if(condition):
+    return F.sum(F.when(condition, 1).otherwise(0))
+
+
+def product_count_columns():
+    """Aggregate expressions counting the total, positive, negative and per-star reviews of a group."""
+    rating = F.col("star_rating")
+    return [F.count(F.lit(1)).alias("product_reviews"),
+            count_if(rating >= POSITIVE_RATING).alias("positive_reviews"),
+            count_if(rating <= NEGATIVE_RATING).alias("negative_reviews"),
+            *[count_if(rating == star).alias("star_%d" % star) for star in STAR_RATINGS]]
+
+
+def product_aggregates(df, hot_products=None):
+    """Total, positive, negative and per-star review counts of every product.
+
+    The rows of hot_products (see skew.hot_keys()) are aggregated in salted
+    buckets first, so no single task has to count all of them.
+    """
+    return salted_aggregate(df, "product_id", product_count_columns(), hot_products)
+
+
+def customer_aggregates(df, hot_customers=None):
+    """Number of reviews written by every customer."""
+    return salted_aggregate(df, "customer_id", [F.count(F.lit(1)).alias("customer_reviews")],
+                            hot_customers)
+
+
+@dataclass
+class ReviewReport:
+    """Exploratory statistics of a cleaned review dataset."""
+    total_reviews: int
+    num_products: int
+    # star rating -> number of reviews, with every rating from 1 to 5 present
+    rating_histogram: dict
+    # product_id, product_reviews, positive_reviews, negative_reviews, star_1 ... star_5
+    product_reviews: DataFrame
+    # customer_id, customer_reviews
+    customer_reviews: DataFrame
+
+    def product(self, product_id):
+        """Return the product_reviews row of product_id, or None if it has no reviews."""
+        rows = to_driver(self.product_reviews.filter(F.col("product_id") == product_id).take(1))
+        return rows[0] if rows else None
+
+    def liked_ratio(self, product_id):
+        """Fraction of the reviews of product_id that are positive."""
+        product = self.product(product_id)
+        if product is None or product.product_reviews == 0:
+            return 0.0
+        return product.positive_reviews / product.product_reviews
+
+    def disliked_ratio(self, product_id):
+        """Fraction of the reviews of product_id that are negative."""
+        product = self.product(product_id)
+        if product is None or product.product_reviews == 0:
+            return 0.0
+        return product.negative_reviews / product.product_reviews
+
+
+def report_from_aggregates(product_reviews, customer_reviews):
+    """The ReviewReport of a product_aggregates() and a customer_aggregates() table."""
+    # one small job over the per-product table gives all the totals
+    totals, = to_driver(product_reviews.agg(
+        F.count(F.lit(1)).alias("num_products"),
+        F.sum("product_reviews").alias("total_reviews"),
+        *[F.sum("star_%d" % star).alias("star_%d" % star) for star in STAR_RATINGS]).take(1))
+
+    return ReviewReport(
+        total_reviews=totals.total_reviews or 0,
+        num_products=totals.num_products,
+        rating_histogram={star: totals["star_%d" % star] or 0 for star in STAR_RATINGS},
+        product_reviews=product_reviews,
+        customer_reviews=customer_reviews)
+
+
+def build_report(df, hot_products=None, hot_customers=None):
+    """Compute the exploratory statistics of the cleaned reviews df in a single scan."""
+    return report_from_aggregates(product_aggregates(df, hot_products),
+                                  customer_aggregates(df, hot_customers))
@@ -0,0 +1,142 @@
+"""Run the review analysis over many Amazon review category files at once.
+
+All the category TSV(.gz) files are read as one dataset with a category
+column taken from their file names, and every statistic is computed for all
+the categories in the same job, grouped by category. The cleaned reviews
+are cached before they are grouped, since a gzipped file can't be split:
+every file is decompressed once, by a single task, rather than once per
+statistic. The sentiment tags and the keyword frequencies are computed from
+one cached scoring of the reviews. Small categories don't
+each pay for their own job scheduling and scan, and the output is a single
+consolidated report with one entry per category.
+
+Usage: batch_runner.py <tsv file or glob> [...] [--output report.json] [--top 5] [--keywords 20] [--no-sentiment]
+"""
+
+import argparse
+import json
+
+import pyspark.sql.functions as F
+from pyspark.sql import SparkSession
+
+from aggregates import STAR_RATINGS, product_count_columns
+from ingest import read_reviews_tsv, clean_reviews
+from metrics import report_from_counts
+from keywords import keyword_frequencies
+from sentiment import add_sentiment
+from topk import top_k_many
+
+# amazon_reviews_us_Jewelry_v1_00.tsv.gz -> Jewelry
+CATEGORY_PATTERN = r"amazon_reviews_[a-z]+_(.+?)_v1_\d+\.tsv"
+FILE_NAME_PATTERN = r"([^/]+?)(\.tsv)?(\.gz)?$"
+
+
+def load_categories(spark, paths):
+    """Read and clean every category file in paths (globs allowed) into one DataFrame."""
+    file_name = F.input_file_name()
+    category = F.regexp_extract(file_name, CATEGORY_PATTERN, 1)
+    fallback = F.regexp_extract(file_name, FILE_NAME_PATTERN, 1)
+    return clean_reviews(read_reviews_tsv(spark, list(paths))) \
+        .withColumn("category", F.when(category != "", category).otherwise(fallback))
+
+
+def _top_per_category(df, columns, key, k):
+    # category -> ranking column -> the k highest rows, all ranked in one pass over df
+    rows = top_k_many(df, columns, k, key, group="category").collect()
+    top = {}
+    for row in sorted(rows, key=lambda row: (row["category"], row["ranking"], row["rank"])):
+        top.setdefault(row["category"], {}).setdefault(row["ranking"], []).append(
+            {key: row[key], row["ranking"]: row["value"]})
+    return top
+
+
+def analyse_categories(reviews, k=5, sentiment=True, keywords=20):
+    """Compute the analysis of every category of reviews, as a dict of category -> report.
+
+    With sentiment, every category also gets its confusion matrix and, when
+    keywords is not 0, the keywords most frequent terms of its positive and
+    negative reviews.
+    """
+    reviews = reviews.cache()
+    products = reviews.groupBy("category", "product_id").agg(*product_count_columns()).cache()
+    customers = reviews.groupBy("category", "customer_id").count() \
+                       .withColumnRenamed("count", "customer_reviews").cache()
+
+    report = {}
+    summary = products.groupBy("category").agg(
+        F.count(F.lit(1)).alias("num_products"),
+        F.sum("product_reviews").alias("total_reviews"),
+        F.sum("positive_reviews").alias("positive_reviews"),
+        F.sum("negative_reviews").alias("negative_reviews"),
+        *[F.sum("star_%d" % star).alias("star_%d" % star) for star in STAR_RATINGS]).collect()
+    for row in summary:
+        report[row["category"]] = {
+            "total_reviews": row["total_reviews"],
+            "num_products": row["num_products"],
+            "positive_reviews": row["positive_reviews"],
+            "negative_reviews": row["negative_reviews"],
+            "rating_histogram": {star: row["star_%d" % star] for star in STAR_RATINGS},
+        }
+
+    for row in customers.groupBy("category").count().collect():
+        report[row["category"]]["num_customers"] = row["count"]
+
+    product_columns = ["product_reviews", "positive_reviews", "negative_reviews"]
+    for category, rankings in _top_per_category(products, product_columns, "product_id", k).items():
+        for column, top in rankings.items():
+            report[category]["top_" + column] = top
+    for category, rankings in _top_per_category(customers, ["customer_reviews"], "customer_id", k).items():
+        report[category]["top_customers"] = rankings["customer_reviews"]
+
+    if sentiment:
+        scored = add_sentiment(reviews.filter(F.col("review_body").isNotNull())).cache()
+        counts = scored.groupBy("category", "sent_score", "star_rating").count().collect()
+        by_category = {}
+        for row in counts:
+            by_category.setdefault(row["category"], []).append(
+                (row["sent_score"], row["star_rating"], row["count"]))
+        for category, category_counts in by_category.items():
+            confusion = report_from_counts(category_counts)
+            report[category]["confusion_matrix"] = {
+                sent: {star: confusion.table[(sent, star)] for star in STAR_RATINGS}
+                for sent in ["pos", "neu", "neg"]}
+            report[category]["class_metrics"] = confusion.class_metrics()
+            report[category]["accuracy"] = confusion.accuracy()
+
+        if keywords:
+            for row in keyword_frequencies(scored, keywords, group_col="category").collect():
+                report[row["category"]].setdefault("keywords", {}) \
+                    .setdefault(row["sentiment"], {})[row["term"]] = row["count"]
+        scored.unpersist()
+
+    products.unpersist()
+    customers.unpersist()
+    reviews.unpersist()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse many Amazon review category files")
+    parser.add_argument("paths", nargs="+", help="category TSV(.gz) files or globs")
+    parser.add_argument("--output", default="category_report.json")
+    parser.add_argument("--top", type=int, default=5, help="number of top products and customers")
+    parser.add_argument("--keywords", type=int, default=20,
+                        help="number of top keywords per sentiment, 0 to skip them")
+    parser.add_argument("--no-sentiment", action="store_true", help="skip the sentiment analysis")
+    args = parser.parse_args()
+
+    spark = SparkSession\
+        .builder\
+        .appName("Spark Customer Review Analysis for Amazon - Categories")\
+        .getOrCreate()
+
+    reviews = load_categories(spark, args.paths)
+    report = analyse_categories(reviews, args.top, not args.no_sentiment, args.keywords)
+
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    for category in sorted(report):
+        print("%s: %d reviews, %d products" % (
+            category, report[category]["total_reviews"], report[category]["num_products"]))
+
+    spark.stop()
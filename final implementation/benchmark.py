@@ -0,0 +1,247 @@
+"""Reproducible benchmark of the review analysis pipeline on local[*].
+
+A synthetic review TSV matching the Amazon Jewelry review schema is generated
+at the requested scale, with Zipf-skewed product_id and customer_id
+frequencies, a realistic star rating mix and log-normal review body lengths
+(the words of a review lean positive or negative with its rating). Every
+stage of the analysis is then timed on it, along with the word count job of
+the initial implementation (and, given a jar, the Hadoop WordCount it
+mirrors), and the results are written to a JSON file
+together with the git commit they were measured at.
+
+For every stage the results record the wall time, the input, output and
+shuffle bytes of the Spark stages it ran, and the peak JVM heap, JVM RSS and
+Python worker RSS of the driver and of every executor (all from the Spark
+UI REST API). The memory peaks are the highest seen since the application
+started, so they only grow from one stage to the next.
+
+Usage: benchmark.py [--rows N [N ...]] [--output results.json] [--workdir dir]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+from pyspark.sql import SparkSession
+
+from aggregates import customer_aggregates, product_aggregates, report_from_aggregates
+from ingest import read_reviews_tsv, clean_reviews
+from keywords import keyword_frequencies
+from metrics import confusion_matrix
+from profiling import group_stages, rest, stage_bytes
+from sentiment import score_reviews
+from topk import top_k, top_k_many
+
+HEADER = ["marketplace", "customer_id", "review_id", "product_id", "product_parent",
+          "product_title", "product_category", "star_rating", "helpful_votes", "total_votes",
+          "vine", "verified_purchase", "review_headline", "review_body", "review_date"]
+
+# share of 1 - 5 star reviews in the Jewelry dataset, roughly
+STAR_PROBABILITIES = [0.08, 0.05, 0.09, 0.17, 0.61]
+
+POSITIVE = np.array(["love", "beautiful", "great", "perfect", "pretty", "gorgeous", "happy", "nice"], dtype=object)
+NEGATIVE = np.array(["cheap", "broke", "disappointed", "ugly", "poor", "returned", "tarnished", "bad"], dtype=object)
+NEUTRAL = np.array(["ring", "necklace", "size", "the", "it", "was", "and", "gift", "chain", "silver",
+                    "earrings", "wear", "daughter", "looks", "color", "bracelet", "box", "small"], dtype=object)
+
+PEAK_MEMORY_METRICS = {
+    "jvm_heap_bytes": "JVMHeapMemory",
+    "jvm_rss_bytes": "ProcessTreeJVMRSSMemory",
+    "python_workers_rss_bytes": "ProcessTreePythonRSSMemory",
+}
+
+WORDCOUNT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "initial implementation", "wordcount.py")
+
+
+def zipf_probabilities(n, exponent):
+    """Probabilities of ranks 1..n under a Zipf law with the given exponent."""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_reviews(path, rows, products=None, customers=None, exponent=1.1,
+                     chunk_size=100000, seed=751):
+    """Write a synthetic review TSV of the given number of rows to path."""
+    rng = np.random.default_rng(seed)
+    products = products or max(rows // 20, 1)
+    customers = customers or max(rows // 2, 1)
+    product_p = zipf_probabilities(products, exponent)
+    customer_p = zipf_probabilities(customers, exponent)
+    start_day = np.datetime64("2000-01-01")
+    days = (np.datetime64("2015-08-31") - start_day).astype(int)
+
+    with open(path, "w") as tsv:
+        tsv.write("\t".join(HEADER) + "\n")
+        for offset in range(0, rows, chunk_size):
+            n = min(chunk_size, rows - offset)
+            product_ids = rng.choice(products, size=n, p=product_p)
+            customer_ids = rng.choice(customers, size=n, p=customer_p)
+            stars = rng.choice(5, size=n, p=STAR_PROBABILITIES) + 1
+            lengths = np.maximum(rng.lognormal(3.0, 0.9, size=n).astype(int), 1)
+            dates = start_day + rng.integers(0, days, size=n)
+            # a review's words lean towards its rating: half of the words of a 4+ star
+            # review are positive, half of those of a 2- star review negative
+            word_stars = np.repeat(stars, lengths)
+            toned = rng.random(word_stars.size) < 0.5
+            words = NEUTRAL[rng.integers(0, NEUTRAL.size, size=word_stars.size)]
+            positive = toned & (word_stars >= 4)
+            negative = toned & (word_stars <= 2)
+            words[positive] = POSITIVE[rng.integers(0, POSITIVE.size, size=positive.sum())]
+            words[negative] = NEGATIVE[rng.integers(0, NEGATIVE.size, size=negative.sum())]
+            bodies = np.split(words, np.cumsum(lengths)[:-1])
+            for i in range(n):
+                tsv.write("\t".join([
+                    "US", str(10000000 + customer_ids[i]), "R%013d" % (offset + i),
+                    "B%09d" % product_ids[i], str(product_ids[i]), "Product %d" % product_ids[i],
+                    "Jewelry", str(stars[i]), "0", "0", "N", "Y", "Review",
+                    " ".join(bodies[i]), str(dates[i])]) + "\n")
+
+
+def executor_peak_memory(spark):
+    """Peak memory of the driver and of every executor, by executor id, in bytes.
+
+    The process tree metrics (the RSS of the JVM and of its Python workers)
+    are only collected with spark.executor.processTreeMetrics.enabled, and
+    are missing otherwise. Returns None when the Spark UI is disabled or
+    can't be reached.
+    """
+    try:
+        executors = rest(spark, "executors")
+    except OSError:
+        return None
+    return {executor["id"]: {metric: executor.get("peakMemoryMetrics", {}).get(field)
+                             for metric, field in PEAK_MEMORY_METRICS.items()}
+            for executor in executors}
+
+
+# job groups are numbered so that stages of the same name in different runs
+# don't share a group
+_stage_runs = itertools.count()
+
+
+def run_stage(spark, results, name, action):
+    """Run action() in its own job group and record its timings and metrics under name."""
+    group = "%s-%d" % (name, next(_stage_runs))
+    spark.sparkContext.setJobGroup(group, name)
+    start = time.perf_counter()
+    value = action()
+    wall_time = time.perf_counter() - start
+    spark.sparkContext.setLocalProperty("spark.jobGroup.id", None)
+
+    stage = {"stage": name, "wall_time_s": wall_time}
+    stage.update(stage_bytes(spark, group_stages(spark, group)[1]))
+    stage["peak_memory"] = executor_peak_memory(spark)
+    results.append(stage)
+    return value
+
+
+def _run(df):
+    # evaluate df completely without moving any rows to the driver
+    df.write.format("noop").mode("overwrite").save()
+
+
+def benchmark_pipeline(spark, path):
+    """Time every stage of the analysis on the review TSV at path."""
+    results = []
+    loaded_info = read_reviews_tsv(spark, path).cache()
+    run_stage(spark, results, "load", loaded_info.count)
+    loaded_info = clean_reviews(loaded_info).cache()
+    run_stage(spark, results, "clean", loaded_info.count)
+
+    product_reviews = product_aggregates(loaded_info).cache()
+    customer_reviews = customer_aggregates(loaded_info).cache()
+    report = run_stage(spark, results, "aggregates",
+                       lambda: report_from_aggregates(product_reviews, customer_reviews))
+    run_stage(spark, results, "customer_aggregates", lambda: report.customer_reviews.count())
+    run_stage(spark, results, "top_k", lambda: (
+        top_k_many(report.product_reviews,
+                   ["product_reviews", "positive_reviews", "negative_reviews"], 5).collect(),
+        top_k(report.customer_reviews, "customer_reviews", 5).collect()))
+
+    scored = score_reviews(loaded_info).cache()
+    run_stage(spark, results, "sentiment", lambda: _run(scored))
+    run_stage(spark, results, "confusion_matrix", lambda: confusion_matrix(scored))
+    run_stage(spark, results, "keywords", lambda: keyword_frequencies(scored).collect())
+    return results
+
+
+def _timed_command(name, command):
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return {"stage": name, "wall_time_s": time.perf_counter() - start}
+
+
+def benchmark_wordcount(path, workdir, hadoop_jar=None):
+    """Time wordcount.py, in output and --top modes, and optionally the Java WordCount.
+
+    Each job runs as its own application; hadoop_jar is a jar holding the
+    WordCount class of mapreduce.java, run with "hadoop jar".
+    """
+    output = os.path.join(workdir, "wordcount_output")
+    shutil.rmtree(output, ignore_errors=True)
+    results = [_timed_command("wordcount", [sys.executable, WORDCOUNT_SCRIPT, path, output]),
+               _timed_command("wordcount_top", [sys.executable, WORDCOUNT_SCRIPT, path, "--top", "20"])]
+    if hadoop_jar:
+        java_output = os.path.join(workdir, "wordcount_java_output")
+        shutil.rmtree(java_output, ignore_errors=True)
+        results.append(_timed_command("wordcount_java",
+                                      ["hadoop", "jar", hadoop_jar, "WordCount", path, java_output]))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the review analysis pipeline")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000],
+                        help="number of synthetic reviews, one run per value")
+    parser.add_argument("--exponent", type=float, default=1.1,
+                        help="Zipf exponent of the product and customer frequencies")
+    parser.add_argument("--seed", type=int, default=751)
+    parser.add_argument("--workdir", default="benchmark_data")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--skip-wordcount", action="store_true")
+    parser.add_argument("--hadoop-jar", help="jar of mapreduce.java's WordCount, to compare against")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    spark = SparkSession\
+        .builder\
+        .master("local[*]")\
+        .appName("Amazon Review Analysis Benchmark")\
+        .config("spark.executor.processTreeMetrics.enabled", "true")\
+        .config("spark.executor.metrics.pollingInterval", "100ms")\
+        .getOrCreate()
+
+    runs = []
+    for rows in args.rows:
+        path = os.path.join(args.workdir, "reviews_%d_%d.tsv" % (rows, args.seed))
+        if not os.path.exists(path):
+            generate_reviews(path, rows, exponent=args.exponent, seed=args.seed)
+        stages = benchmark_pipeline(spark, path)
+        if not args.skip_wordcount:
+            stages.extend(benchmark_wordcount(path, args.workdir, args.hadoop_jar))
+        runs.append({"rows": rows, "input_bytes": os.path.getsize(path), "stages": stages})
+        spark.catalog.clearCache()
+
+    spark.stop()
+
+    with open(args.output, "w") as output:
+        json.dump({"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "python": platform.python_version(), "cpus": os.cpu_count(),
+                   "exponent": args.exponent, "seed": args.seed, "runs": runs}, output, indent=2)
+    print("Wrote %s" % args.output)
@@ -22,6 +22,7 @@ We aim to use Python to code our Spark programs, but because Spark setup is main
 !tar -xvf spark-3.1.1-bin-hadoop2.7.tgz
 !pip install -q findspark
 !pip install pyspark
+!pip install -q pyarrow
 
 """This installs all the necessary dependencies in Colab. Now, we can set the environment variables to point to this virtual machine and and use the downloaded Spark path. This will enable us to run Pyspark in the Colab environment."""
 
@@ -41,12 +42,11 @@ from pyspark.sql import SparkSession
 
 spark = SparkSession.builder.master("local[*]").getOrCreate()
 
-"""We use the spark.sql.shuffle.partitions to redistribute data across the RDD (a Spark database) frame."""
+"""We use the spark.sql.shuffle.partitions to redistribute data across the RDD (a Spark database) frame. Rather than fixing it, it is picked from the size of the dataset once it is loaded."""
 
 spark = SparkSession \
     .builder \
     .appName("Spark Customer Review Analysis for Amazon") \
-    .config("spark.sql.shuffle.partitions", "100")\
     .getOrCreate()
 
 """A Spark application called "Spark Review Analysis for Amazon" should be running on the server. Now, let's try loading the dataset. Our dataset is a structured file (.csv), which makes it easier to analyse large amounts of data as well. The dataset is stored on a shared Google Drive folder, but the file might need to be publicly accessible.  """
@@ -57,14 +57,50 @@ import io
 from google.colab import drive
 drive.mount('/content/gdrive')
 
-"""The dataset we are using is a .tsv file obtained from Amazon's Jewelry Review dataset on: https://s3.amazonaws.com/amazon-reviews-pds/tsv/amazon_reviews_us_Jewelry_v1_00.tsv.gz. Because this is a .tsv file instead of a .csv, we need to explicitly declare the separator to be a TAB space instead of a COMMA separator.  """
+"""The dataset we are using is a .tsv file obtained from Amazon's Jewelry Review dataset on: https://s3.amazonaws.com/amazon-reviews-pds/tsv/amazon_reviews_us_Jewelry_v1_00.tsv.gz. Because this is a .tsv file instead of a .csv, we need to explicitly declare the separator to be a TAB space instead of a COMMA separator.  
 
-#upload the Kaggle downloaded dataset - Swathi 
-loaded_info =spark.read.csv('/content/gdrive/My Drive/751/amazon_reviews_us_Jewelry_v1_00.tsv', sep='\t', inferSchema=True, header=True)
+Rather than inferring the column types with an extra pass over the file, ingest.py declares the fixed Amazon reviews schema. The first run parses the .tsv.gz once (Spark decompresses it while reading, so there is no need to unzip it), drops reviews with an invalid star rating and writes the result as a Parquet dataset partitioned by star_rating. Every later run loads the Parquet dataset directly.
+"""
+
+import sys
+# the helper modules (sentiment.py, ingest.py, ...) are stored next to this notebook
+DATA_DIR = '/content/gdrive/MyDrive/SOFTENG 751'
+sys.path.append(DATA_DIR)
+
+from ingest import convert_to_parquet, is_converted, load_reviews
+from profiling import Profiler
+
+"""Every step below runs in a named profiler.stage(), which records its wall time, the Spark jobs and stages it ran with their input, shuffle and output bytes, the rows it moved to the driver and the CPU time of the driver. The steps are saved as a trace at the end of the notebook."""
+
+profiler = Profiler(spark)
+
+reviews_tsv = DATA_DIR + '/amazon_reviews_us_Jewelry_v1_00.tsv.gz'
+reviews_parquet = DATA_DIR + '/amazon_reviews_us_Jewelry_v1_00.parquet'
+
+# convert the dataset to Parquet only once, redoing an interrupted conversion
+if not is_converted(reviews_parquet):
+  with profiler.stage("convert_to_parquet"):
+    convert_to_parquet(spark, reviews_tsv, reviews_parquet)
+
+loaded_info = load_reviews(spark, reviews_parquet)
+
+from skew import configure_shuffle_partitions
+
+# about 128MB of input per shuffle partition, and at least one per core
+print("Using %d shuffle partitions" % configure_shuffle_partitions(spark, reviews_parquet))
 
-#upload the Kaggle downloaded dataset - Sahana
-loaded_info = spark.read.csv('/content/gdrive/MyDrive/SOFTENG 751/amazon_reviews_us_Jewelry_v1_00.tsv',
-                  sep='\t', inferSchema=True, header=True)
+"""Several dataframes below are read by more than one step. Rather than caching them by hand and forgetting to release them, they are registered with an ExecutionPlanner along with the number of steps that read them. The planner persists a dataframe the first time it is read (in memory, or spilling to disk, depending on its estimated size), logs whether every read was served from the cache, and unpersists it after its last reader."""
+
+import logging
+from planner import ExecutionPlanner
+
+logging.basicConfig(format="%(name)s: %(message)s")
+logging.getLogger("planner").setLevel(logging.INFO)
+
+planner = ExecutionPlanner(spark)
+# the cleaned reviews are scanned by hot_keys() twice, the per-product and per-customer aggregations,
+# the top product details, the two samples, and the two scans of score_with_cache()
+planner.register("loaded_info", loaded_info, consumers=9)
 
 """The dataset should now be loaded. printSchema() should show the columns and their data types as a hierarchy arising from 'root'."""
 
@@ -90,15 +126,32 @@ Getting a general overview on what reviews are like helps Amazon better understa
 
 #### Total Reviews in Database
 
-We assume that, for the scope of this project, every review has a star rating of 1 - 5. This means we would have to clean out records that are invalid (NULL, or other types).
+We assume that, for the scope of this project, every review has a star rating of 1 - 5. This means we would have to clean out records that are invalid (NULL, or other types). This was done once by clean_reviews() when the dataset was converted to Parquet, so loaded_info only holds valid reviews.
 """
 
 import pyspark.sql.functions as F
-
-# Taking invalid star ratings out of our dataset 
-loaded_info = loaded_info.filter(F.col("star_rating").cast("int").isNotNull()) 
-
-ratings_df = loaded_info.groupBy("star_rating").count().withColumnRenamed("count","num_ratings")
+from aggregates import customer_aggregates, product_aggregates, report_from_aggregates
+from skew import count_stats, hot_keys
+
+"""A handful of products and customers own a disproportionate share of the reviews. hot_keys() finds them from a 1% sample, and the aggregations split their reviews over several tasks so they don't hold up the rest of the grouping."""
+
+with profiler.stage("hot_products"), planner.using("loaded_info") as reviews:
+  hot_products = hot_keys(reviews, "product_id")
+with profiler.stage("hot_customers"), planner.using("loaded_info") as reviews:
+  hot_customers = hot_keys(reviews, "customer_id")
+print("Hot products: %s" % hot_products)
+print("Hot customers: %s" % hot_customers)
+
+# compute the exploratory statistics in a single scan of loaded_info
+with profiler.stage("build_report"), planner.using("loaded_info") as reviews:
+  # read for the totals, shown, for the skew, ranked, summarised, and read for the star counts and liked ratios of two products
+  product_reviews = planner.register("product_reviews", product_aggregates(reviews, hot_products), consumers=9)
+  # shown, and ranked for the top customers twice
+  customer_reviews = planner.register("customer_reviews", customer_aggregates(reviews, hot_customers), consumers=3)
+  with planner.using("product_reviews") as products:
+    report = report_from_aggregates(products, customer_reviews)
+
+ratings_df = spark.createDataFrame(sorted(report.rating_histogram.items()), ["star_rating","num_ratings"])
 ratings_df.show()
 
 """We can plot the distribution of ratings from 1-5 using the pandas module in Python."""
@@ -106,9 +159,7 @@ ratings_df.show()
 import matplotlib.pyplot as plt
 import pandas as pd
 
-ratings_plot = pd.DataFrame(ratings_df.collect())
-ratings_plot.columns = ['star_rating','num_ratings']
-ratings_plot.sort_values(by=['star_rating'], inplace=True)
+ratings_plot = pd.DataFrame(sorted(report.rating_histogram.items()), columns=['star_rating','num_ratings'])
 
 ratings_plot.plot(kind='bar',x='star_rating',y='num_ratings',color='green')
 plt.show()
@@ -116,65 +167,109 @@ plt.show()
 """We can also find the number of records in this cleaned dataset to obtain the total number of reviews in the dataset."""
 
 # count the number of valid reviews in the dataset
-print("There are %d reviews in the cleaned dataset." % loaded_info.count())
+print("There are %d reviews in the cleaned dataset." % report.total_reviews)
 
 """#### Reviews Per Unique Product
 
-The number of reviews per product can be obtained by creating a collection of records that fall under the same product IDs. The groupBy() function makes a collection. withColumnRenamed() takes in the column that needs to be changed, and changes it to the parameter inserted second.
+The number of reviews per product can be obtained by creating a collection of records that fall under the same product IDs. product_aggregates() grouped the reviews by product_id once, counting the total, positive (4+ stars), negative (2- stars) and per-star reviews of every product in the same pass.
 """
 
-# categorise reviews by the product's id (which is unique) and create a dataframe product_reviews
-product_reviews = loaded_info.groupBy("product_id").count().withColumnRenamed("count","product_reviews")
-product_reviews.show()
+# reviews categorised by the product's id (which is unique)
+with profiler.stage("show_product_reviews"), planner.using("product_reviews") as products:
+  products.show()
+
+# how unevenly the reviews are spread over the products, from the per-product counts
+with profiler.stage("skew_stats"), planner.using("product_reviews") as products:
+  print(count_stats(products, "product_reviews", "product_id"))
+
+"""#### Approximate Statistics
+
+summary() computes exact percentiles, which gets slow for the full (or multi-category) datasets. With APPROXIMATE set, the review count percentiles are estimated with a sketch instead and summary() below is skipped. The number of distinct products and customers and the most reviewed products are sketched too. The sketches are saved, so the sketches of other categories or days can be merged with them later without re-reading any reviews.
+
+The sketches are built from the per-product and per-customer tables, which the rest of the notebook needs anyway, never from the review rows: every product and customer is added once. The exact number of products comes for free with those tables, so it is printed either way.
+"""
+
+APPROXIMATE = False
+
+if APPROXIMATE:
+  from sketches import ReviewSketches, sketch_customers, sketch_products
+
+  # reads product_reviews in place of summary(), so it counts as the same consumer
+  with profiler.stage("sketch_products"), planner.using("product_reviews") as products:
+    product_sketch, frequency_sketch, quantile_sketch = sketch_products(products, error=0.01)
 
 """#### Number of Products"""
 
 # count how many products there are
-print("There are %d products in the cleaned database" % product_reviews.count())
+print("There are %d products in the cleaned database" % report.num_products)
 
 """#### 5 Highest Reviewed Jewellery Products
 
-We can use sort() to a dataframe to arrange the rows in a particular order. We want the highest records to be on top, so we use ascending=False. take(5) grabs the first 5 records as objects in a list. In order to display it as a table, we need to convert it back to a dataframe using spark.createDataFrame().
+Sorting every product just to keep the first 5 would shuffle the whole table. Instead, top_k_many() keeps the 5 highest products of every partition in a small heap and merges the heaps, ranking the products by total, positive and negative reviews in the same pass. The result is already a dataframe, so there is no need to convert it back using spark.createDataFrame().
 """
 
-# from the dataframe, obtain the 5 highest reviewed products 
-top_products = product_reviews.sort("product_reviews",ascending=False).take(5)
+from topk import top_k, top_k_many
+
+# rank the products by total, positive and negative reviews at once
+with profiler.stage("top_k_products"), planner.using("product_reviews") as products:
+  # top_k_many() collects the rankings as it runs, so product_rankings is a small local table with nothing to cache
+  product_rankings = top_k_many(products, ["product_reviews","positive_reviews","negative_reviews"], 5)
 
-# change the list back to dataframe
-top_products = spark.createDataFrame(top_products)
-top_products.show()
+def ranked_products(ranking):
+  return product_rankings.filter(F.col("ranking") == ranking).orderBy("rank") \
+                         .select("product_id", F.col("value").alias(ranking))
+
+# from the rankings, obtain the 5 highest reviewed products 
+top_products = ranked_products("product_reviews")
+# shown, joined to its details, and read to pick the products analysed below
+planner.register("top_products", top_products, consumers=5)
+with profiler.stage("show_top_products"), planner.using("top_products") as products:
+  products.show()
 
 """#### Details of Highest Reviewed Product"""
 
-top_products.join(loaded_info,"product_id","left").select("product_id","product_reviews","marketplace","product_title","product_category").show(1)
+with profiler.stage("top_product_details"), planner.using("top_products") as products, planner.using("loaded_info") as reviews:
+  products.join(reviews,"product_id","left").select("product_id","product_reviews","marketplace","product_title","product_category").show(1)
 
 """#### Summary of Product Reviews
 
 We use summary() to extract the largest number of products, which is in the field 'count', the mean product reviews, the standard deviation of reviews, and the median number of reviews in which is in the field '50%'.
 """
 
-product_reviews.select('product_reviews').summary().show()
+if APPROXIMATE:
+  print(dict(zip([0.25, 0.5, 0.75], quantile_sketch.quantiles([0.25, 0.5, 0.75]))))
+else:
+  with profiler.stage("product_review_summary"), planner.using("product_reviews") as products:
+    products.select('product_reviews').summary().show()
 
 """#### Number of Reviews Per Customer"""
 
-# Create the consumer_table DataFrame
-customer_reviews = loaded_info.groupBy('customer_id').count().withColumnRenamed("count", "customer_reviews").cache()
-customer_reviews.show()
+# the consumer_table DataFrame, whose grouping is materialised by show()
+with profiler.stage("show_customer_reviews"), planner.using("loaded_info"), planner.using("customer_reviews") as customers:
+  customers.show()
+  if APPROXIMATE:
+    # sketched while customer_reviews is cached for show()
+    review_sketches = ReviewSketches(product_sketch, sketch_customers(customers, error=0.01),
+                                     frequency_sketch, quantile_sketch)
+
+if APPROXIMATE:
+  review_sketches.save(DATA_DIR + '/amazon_reviews_us_Jewelry_v1_00.sketches.json')
+  print(review_sketches.summary())
 
 """#### 5 Customers That Reviewed The Most"""
 
 # obtain the top 5 records of sorted dataframe
-top_customers = customer_reviews.sort("customer_reviews",ascending=False).take(5)
-# change the list back to dataframe
-top_customers = spark.createDataFrame(top_customers)
-top_customers.show()
+top_customers = top_k(customer_reviews, "customer_reviews", 5)
+with profiler.stage("top_k_customers"), planner.using("customer_reviews"):
+  top_customers.show()
 
 """### Most Influential Customer
 
 The most influential customer, according to our scope, is the customer that has reviewed the most.
 """
 
-top_customers.show(1)
+with planner.using("customer_reviews"):
+  top_customers.show(1)
 
 """## Review Analysis
 
@@ -183,11 +278,19 @@ Review Analysis can be very critical for statistical computations or analysis. V
 ### Selecting Positive Reviews
 
 Positive reviews are considered to be reviews whose star_rating is either 4 stars or 5 stars, on a scale of 1 star to 5 stars.
+
+The readings below look at a sample of 10000 reviews. Rather than taking the rows to the driver and creating a new dataframe from them, sample_reviews() samples them on the executors. SAMPLE_METHOD chooses between the first 10000 reviews by review_id ('first', so every star rating partition of the Parquet files contributes), a sample in which every star rating is represented in proportion to the whole dataset ('stratified'), and a seeded uniform sample ('random').
 """
 
-# select all reviews in the top 10000 records that are over 3 stars
-tenthous_positive_readings = spark.createDataFrame(loaded_info.take(10000)).filter("star_rating >= 4")
-print("The number of reviews exceeding 3 stars for the first 10000 records are %d." % tenthous_positive_readings.count())
+from sampling import sample_reviews
+
+SAMPLE_METHOD = 'first'
+SAMPLE_SIZE = 10000
+
+# select all reviews in the sample of 10000 records that are over 3 stars
+with profiler.stage("sample_positive_readings"), planner.using("loaded_info") as reviews:
+  tenthous_positive_readings = sample_reviews(reviews, SAMPLE_SIZE, SAMPLE_METHOD, report.rating_histogram).filter("star_rating >= 4")
+  print("The number of reviews exceeding 3 stars for the %s %d records are %d." % (SAMPLE_METHOD, SAMPLE_SIZE, tenthous_positive_readings.count()))
 
 """#### Positive Reviews of 5th Most Popular Product
 
@@ -195,24 +298,24 @@ We are selecting the product that is the 5th popular one, row index 4 of the dat
 """
 
 # obtain the product id of the 5th element from the set of top products reviewed
-product_id = list(top_products.select("product_id").take(5))
+with profiler.stage("top_product_ids") as record, planner.using("top_products") as products:
+  product_id = record.to_driver(products.select("product_id").take(5))
 
-# filter positive readings for particular product_id by star_rating
-positive_readings = loaded_info.filter("product_id = '%s' and star_rating >= 4" % product_id[4][0])\
-                .groupBy("star_rating").count().withColumnRenamed("count","positive_reviews")
+# read the positive readings for particular product_id by star_rating from its per-star counts
+with profiler.stage("positive_readings"), planner.using("product_reviews"):
+  product = report.product(product_id[4][0])
+positive_readings = pd.DataFrame({"star_rating": [4, 5], "positive_reviews": [product.star_4, product.star_5]})
 print("The product being analysed is '%s'" % product_id[4][0])
-positive_readings.show()
+print(positive_readings)
 
 """#### 5 Highest Positively Reviewed Products
 
-For the dataframe that has records with star_rating >=4, every record is collected by product_id (which is unique). The count() function counts the number of reviews every product has, and the whole collection is sorted in descending order to display highest reviewed products.
+The number of reviews with star_rating >=4 of every product was already counted in the per-product table, and the products were ranked by positive_reviews together with the 5 highest reviewed products.
 
 We're only displaying the first 5, and hence show(5).
 """
 
-highest_positives = loaded_info.filter("star_rating >=4").groupBy("product_id") \
-                   .count().withColumnRenamed("count","positive_reviews") \
-                   .sort("positive_reviews",ascending=False)
+highest_positives = ranked_products("positive_reviews")
 highest_positives.show(5)
 
 """### Selecting Negative Reviews
@@ -220,9 +323,10 @@ highest_positives.show(5)
 Negative reviews are considered to be reviews whose star_rating is either 1 star or 2 stars, on a scale of 1 star to 5 stars.
 """
 
-# select all reviews in the top 10000 under 3 stars as negative
-tenthous_negative_readings = spark.createDataFrame(loaded_info.take(10000)).filter("star_rating <= 2")
-print("The number of reviews under 3 stars for the first 10000 records are %d." % tenthous_negative_readings.count())
+# select all reviews in the sample of 10000 under 3 stars as negative
+with profiler.stage("sample_negative_readings"), planner.using("loaded_info") as reviews:
+  tenthous_negative_readings = sample_reviews(reviews, SAMPLE_SIZE, SAMPLE_METHOD, report.rating_histogram).filter("star_rating <= 2")
+  print("The number of reviews under 3 stars for the %s %d records are %d." % (SAMPLE_METHOD, SAMPLE_SIZE, tenthous_negative_readings.count()))
 
 """#### Negative Reviews for Most Popular Product
 
@@ -230,19 +334,19 @@ Let's analyse the most popular product for its negative reviews.
 """
 
 # obtain the product id of the most popular product ([0][0] for top_products) from the set of trending reviews
-product_id = list(top_products.select("product_id").take(1))
+with profiler.stage("top_product_ids") as record, planner.using("top_products") as products:
+  product_id = record.to_driver(products.select("product_id").take(1))
 
-# filter negative readings for particular product_id by star_rating
-negative_readings = loaded_info.filter("product_id = '%s' and star_rating <= 2" % product_id[0][0])\
-                .groupBy("star_rating").count().withColumnRenamed("count","negative_reviews")
+# read the negative readings for particular product_id by star_rating from its per-star counts
+with profiler.stage("negative_readings"), planner.using("product_reviews"):
+  product = report.product(product_id[0][0])
+negative_readings = pd.DataFrame({"star_rating": [1, 2], "negative_reviews": [product.star_1, product.star_2]})
 print("The product being analysed is '%s'" % product_id[0][0])
-negative_readings.show()
+print(negative_readings)
 
 """#### 5 Highest Negatively Reviewed Products"""
 
-highest_negatives = loaded_info.filter("star_rating <=2").groupBy("product_id") \
-                   .count().withColumnRenamed("count","negative_reviews") \
-                   .sort("negative_reviews",ascending=False)
+highest_negatives = ranked_products("negative_reviews")
 highest_negatives.show(5)
 
 """### Is A Product Overall Liked or Not?
@@ -251,18 +355,19 @@ For the 5th most popular product, we can say the product is overall liked by cus
 """
 
 # obtain total number of reviews for product_id[4][0]
-product_id = list(top_products.select("product_id").take(5))
-reviews_for_select_product = product_reviews.filter("product_id = '%s'" % product_id[4][0]).collect()
+with profiler.stage("top_product_ids") as record, planner.using("top_products") as products:
+  product_id = record.to_driver(products.select("product_id").take(5))
+with profiler.stage("product_lookup"), planner.using("product_reviews"):
+  reviews_for_select_product = report.product(product_id[4][0])
 
-print('The total number of reviews for this product is: ', reviews_for_select_product[0][1])
+print('The total number of reviews for this product is: ', reviews_for_select_product.product_reviews)
 
-total_curr_reviews = reviews_for_select_product[0][1]
+total_curr_reviews = reviews_for_select_product.product_reviews
 # find 50% of that value
 fifty_percent_curr_reviews = total_curr_reviews/2
 
-# find positive reviews
-pos_revs = positive_readings.collect()
-total_pos_revs = (pos_revs[0][1] + pos_revs[1][1])
+# find positive reviews (4 and 5 stars), which is 0 if the product has none
+total_pos_revs = reviews_for_select_product.positive_reviews
 
 # if positive > 50% of total, mark as popular
 if (total_pos_revs > fifty_percent_curr_reviews):
@@ -273,17 +378,17 @@ else:
 """For the most popular product, we can say the product is overall liked by customers if the total number of negative reviews < 50% of total reviews."""
 
 # obtain total number of reviews for product_id[0][0]
-reviews_for_select_product = top_products.filter("product_id = '%s'" % product_id[0][0]).collect()
+with profiler.stage("product_lookup"), planner.using("product_reviews"):
+  reviews_for_select_product = report.product(product_id[0][0])
 
-print('The total number of reviews for this product is: ', reviews_for_select_product[0][1])
+print('The total number of reviews for this product is: ', reviews_for_select_product.product_reviews)
 
-total_curr_reviews = reviews_for_select_product[0][1]
+total_curr_reviews = reviews_for_select_product.product_reviews
 # find 50% of that value
 fifty_percent_curr_reviews = total_curr_reviews/2
 
-# find negative reviews
-neg_revs = negative_readings.collect()
-total_neg_revs = (neg_revs[0][1] + neg_revs[1][1])
+# find negative reviews (1 and 2 stars), which is 0 if the product has none
+total_neg_revs = reviews_for_select_product.negative_reviews
 
 # if negative < 50% of total, mark as popular
 if (total_neg_revs < fifty_percent_curr_reviews):
@@ -318,142 +423,154 @@ from textblob import TextBlob
 from textblob.sentiments import NaiveBayesAnalyzer
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
+from sentiment import get_analyser, label_compound, add_sentiment
+
 # VADER sentiment analysis tool for getting pos, neg and neu tags.
 def VADER_sentimental_score(sentence):
-    # initialise an analyser for the program
-    sent_analyser = SentimentIntensityAnalyzer()
+    # reuse the analyser of this Python process instead of reloading the lexicon
+    sent_analyser = get_analyser()
     # obtain polarity scores for the review from the analyser
     vader_scores = sent_analyser.polarity_scores(sentence)
     # 'compound' is the label that stores the overall 'tone' tag and is between 1 and -1
-    score = vader_scores['compound']
-    if score >= 0.5:
-        return 'pos'
-    elif (score > -0.5) and (score < 0.5):
-        return 'neu'
-    elif score <= -0.5:
-        return 'neg'
+    return label_compound(vader_scores['compound'])
 
-"""Once this function has been created, we can check our dataframe for any NULL values in the review body, and filter them out. This is because we won't be able to analyse reviews of this sort using the analyser. 
+"""Scoring reviews one at a time on the driver only works for a small sample, so the same analysis is run on the executors instead. add_sentiment() scores batches of review bodies with a pandas UDF, keeping one analyser per Python worker, and adds the raw 'compound' score as well as the 'sent_score' tag to every review. Reviews with a NULL review body can't be analysed, so both columns are NULL for them. 
 
-Again, we're only examining the first 10000 rows of the dataset for the sake of not hogging Google Colab's resources. 
+This covers the whole dataset rather than only the first 10000 rows. Scores are also kept in a cache keyed by a hash of the review text, so re-running the notebook, or reviews that repeat the same text ("Love it!", "Beautiful"), don't need to be scored again. Only the texts missing from the cache are scored and added to it.
 """
 
-import numpy
-# if the review_body field is empty, filter out because can't perform sentiment analysis on NULL
-review_bodies = loaded_info.select("product_id","review_body") \
-                .filter("review_body IS NOT NULL").take(10000)
-
-"""For every review that we find, we need to store the product_id (as that is the identifying field), as well as the sentiment tag.  """
+from sentiment_cache import score_with_cache
 
-# review_bodies is a list
-sentiment_score = [[0 for i in range(2)] for j in range(10000)]
-for i in range(10000):
-  sentiment_score[i][0] = (review_bodies[i][0])
-  sentiment_score[i][1] = VADER_sentimental_score(review_bodies[i][1])
+# score every review on the executors, reusing cached scores
+with profiler.stage("score_with_cache"), planner.using("loaded_info") as reviews:
+  # the texts missing from the cache are found, scored and added to it in one scan of loaded_info;
+  # joining the scores shuffles every review, so the scored reviews are kept for
+  # show(), score_reviews(), summarise_products() and daily_rollups()
+  scored_reviews = planner.register("scored_reviews", score_with_cache(reviews, DATA_DIR + '/sentiment_cache'), consumers=4)
+# the scores are joined to the reviews in the second, and last, scan of loaded_info, once for all the consumers
+with profiler.stage("show_scored_reviews"), planner.using("loaded_info"), planner.using("scored_reviews") as scored:
+  print("%d reviews scored" % scored.count())
+  scored.select("product_id","compound","sent_score").show()
 
 """### Review Comparison - CONFUSION MATRIX
 
-With these sentiment scores, we can combine this dataframe with the review_bodies and a set of star_rating(s) to get a dataframe with three columns.
+For every review that we find, we need to keep the review_id (the primary key), the product_id, the review_body and the star_rating next to the sentiment tag. product_id is not unique, so joining separate dataframes on it would pair every review of a product with every other review of that product. score_reviews() instead keeps all these fields on the same row as the sentiment scores, so no join is needed.
 """
 
-# with these positive and negative reviews, we can potentially make a new dataframe
-review_bodies_df = spark.createDataFrame(review_bodies)
+from sentiment import score_reviews
 
-from pyspark.sql.types import StringType
-sentiment_score_df = spark.createDataFrame(sentiment_score).withColumnRenamed("_1","product_id").withColumnRenamed("_2","sent_score")
-star_rating_df = spark.createDataFrame(loaded_info.select("product_id","star_rating").take(10000))
-
-new_analysis_df = spark.createDataFrame(sentiment_score_df.join(review_bodies_df,"product_id","inner") \
-                                     .join(star_rating_df,"product_id","inner").take(10000))
-new_analysis_df.show()
+# if the review_body field is empty, filter out because can't perform sentiment analysis on NULL
+with planner.using("scored_reviews") as scored:
+  new_analysis_df = score_reviews(scored)
+# shown, and read by the confusion matrix, the threshold sweep, the keywords, and the two comparisons at the end
+planner.register("new_analysis_df", new_analysis_df, consumers=6)
+with profiler.stage("show_sentiment"), planner.using("new_analysis_df") as analysis:
+  analysis.show()
 
 """This table gives us all the fields required to compute a confusion matrix.
 
+Rather than counting filtered copies of new_analysis_df one at a time, confusion_matrix() counts the reviews of every (sent_score, star_rating) pair in a single aggregation. The true/false positives and negatives below are all read from that table.
+
 We know already that every star_rating of 4 and above is a positive rating. So, we find the number of true positives, by comparing a 4+ star rating with a 'pos' tag.
 """
 
-# select the records that are both pos and above 3 stars
-sent_pred_pos_df = new_analysis_df.filter("star_rating >=4")
-tot_pos_count = sent_pred_pos_df.count()
+from metrics import confusion_matrix, threshold_sweep
 
-sent_pred_pos_df = sent_pred_pos_df.filter("sent_score='pos'")
-print("The number of true positive reviews in the database is %d." % sent_pred_pos_df.count())
+with profiler.stage("confusion_matrix"), planner.using("new_analysis_df") as analysis:
+  confusion = confusion_matrix(analysis)
+
+# select the records that are both pos and above 3 stars
+tot_pos_count = confusion.count(ratings=[4, 5])
+true_pos_count = confusion.count('pos', [4, 5])
+print("The number of true positive reviews in the database is %d." % true_pos_count)
 
 # find percentage of correct predictions 
-print("Percentage of true positive predictions by the VADER analyser for the first 10000 reviews is %f." % (float)(sent_pred_pos_df.count()*100/tot_pos_count))
+print("Percentage of true positive predictions by the VADER analyser for all reviews is %f." % (float)(true_pos_count*100/tot_pos_count))
 
 """We can find the false positives, by checking for a star_rating of 4+ but with the tag 'neg'."""
 
 # false positives
-sent_pred_false_pos_df = new_analysis_df.filter("star_rating >=4").filter("sent_score='neg'")
-print("The number of false positive reviews in the database is %d." % sent_pred_false_pos_df.count())
+false_pos_count = confusion.count('neg', [4, 5])
+print("The number of false positive reviews in the database is %d." % false_pos_count)
 
 # find percentage of false positives
-print("Percentage of false positive predictions by the VADER analyser for the first 10000 reviews is %f." % (float)(sent_pred_false_pos_df.count()*100/tot_pos_count))
+print("Percentage of false positive predictions by the VADER analyser for all reviews is %f." % (float)(false_pos_count*100/tot_pos_count))
 
 """A similar analysis can be done for negative reviews, where 2- stars are considered absolute negatives. A tag 'neg' with 2- stars is a true negative, while a 'pos' tag with 2- stars is a false negative. """
 
 # select the records that are both neg and below 3 stars
-sent_pred_neg_df = new_analysis_df.filter("star_rating <=2")
-tot_neg_count = sent_pred_neg_df.count()
-
-sent_pred_neg_df = sent_pred_neg_df.filter("sent_score='neg'")
-print("The number of true negative reviews in the database is %d." % sent_pred_neg_df.count())
+tot_neg_count = confusion.count(ratings=[1, 2])
+true_neg_count = confusion.count('neg', [1, 2])
+print("The number of true negative reviews in the database is %d." % true_neg_count)
 
 # find percentage of correct predictions 
-print("Percentage of true negative predictions by the VADER analyser for the first 10000 reviews is %f." % (float)(sent_pred_neg_df.count()*100/tot_neg_count))
+print("Percentage of true negative predictions by the VADER analyser for all reviews is %f." % (float)(true_neg_count*100/tot_neg_count))
 
 # false negatives
-sent_pred_false_neg_df = new_analysis_df.filter("star_rating <=2").filter("sent_score='pos'")
-print("The number of false negative reviews in the database is %d." % sent_pred_false_neg_df.count())
+false_neg_count = confusion.count('pos', [1, 2])
+print("The number of false negative reviews in the database is %d." % false_neg_count)
 
 # find percentage of false negatives
-print("Percentage of false negative predictions by the VADER analyser for the first 10000 reviews is %f." % (float)(sent_pred_false_neg_df.count()*100/tot_neg_count))
+print("Percentage of false negative predictions by the VADER analyser for all reviews is %f." % (float)(false_neg_count*100/tot_neg_count))
+
+"""We can now compute the confusion matrix. The full table has a row for every sentiment tag and a column for every star rating, and the precision, recall and F1 of every sentiment class follow from it."""
+
+print(confusion.to_pandas())
+print(pd.DataFrame(confusion.class_metrics()).T)
+
+"""The +-0.5 cutoff on the VADER 'compound' score is a choice. threshold_sweep() aggregates the compound scores per star rating once, and evaluates the confusion matrix for every cutoff from that, without scoring the reviews again."""
+
+with profiler.stage("threshold_sweep"), planner.using("new_analysis_df") as analysis:
+  sweep = threshold_sweep(analysis, [0.05, 0.25, 0.5, 0.75])
+for threshold, cutoff_report in sweep.items():
+  print("Cutoff %.2f: accuracy %f" % (threshold, cutoff_report.accuracy()))
+
+"""### Comparing Sentiment Analysers
+
+VADER is one of several analysers we could use. TextBlob's polarity and a linear model trained on the star ratings themselves (hashed TF-IDF features with a logistic regression, using Spark ML) can be scored the same way. compare_backends() scores a sample of reviews with each of them, and reports how many reviews per second each one scores per core, and how well its tags agree with the star ratings, using the same confusion matrix as above. The polarities of the analysers are spread differently, so each is evaluated at its own default cutoff and at the best cutoff of a threshold sweep.
+"""
+
+COMPARE_BACKENDS = False
+
+if COMPARE_BACKENDS:
+  from sentiment_backends import VaderBackend, TextBlobBackend, LinearModelBackend, compare_backends
 
-"""We can now compute the confusion matrix. This matrix is detailed in the report rather than being plotted on Colab.
+  training, testing = new_analysis_df.drop("compound","sent_score").randomSplit([0.8, 0.2], seed=751)
+  sample = testing.sample(fraction=0.1, seed=751).cache()
+  linear = LinearModelBackend().fit(training)
+  with profiler.stage("compare_backends"):
+    print(compare_backends(sample, [VaderBackend(), TextBlobBackend(), linear],
+                           thresholds=[0.05, 0.1, 0.25, 0.5, 0.75]))
+  sample.unpersist()
 
-### Creating WordClouds
+"""### Creating WordClouds
 
 WordClouds are a great way to visualise most featured keywords from a database. Here, using the 'pos' and 'neg' tags for every review, we are able to tokenise every word of the review and pick out keywords.
 
 Here, the NLTK package comes in handy, with some in-built modules like 'stopwords' and 'word_tokenize' to pick out keywords.
 """
 
-# gather fields that are tagged positive from the first 10000 rows
-pos = new_analysis_df.filter(new_analysis_df.sent_score == "pos").select('review_body')
-pos = pos.collect()
+from keywords import keyword_frequencies, frequencies_for, tokenise_review
 
-# gather fields that are tagged negative from the first 10000 rows
-neg = new_analysis_df.filter(new_analysis_df.sent_score == "neg").select('review_body')
-neg = neg.collect()
+"""We use tokenise_review() to take in a review_body and obtain its keywords: it lower-cases and tokenises the review, and drops punctuation and stopwords.
 
-from nltk.corpus import stopwords
+Collecting every positive and negative review to build one long string of keywords would not fit on the driver for the whole dataset. Instead, keyword_frequencies() tokenises the reviews on the executors, counts how often every keyword occurs for each sentiment, and only keeps the 200 most frequent keywords of the 'pos' and 'neg' reviews."""
 
-"""We create a function that takes in a list, finds the review_body from the list and obtains keywords from the review_body."""
+# count the keywords of the reviews tagged positive and negative
+with profiler.stage("keyword_frequencies"), planner.using("new_analysis_df") as analysis:
+  # shown, and read for the positive and negative WordClouds
+  keyword_counts = planner.register("keyword_counts", keyword_frequencies(analysis, top_n=200), consumers=2)
+  with planner.using("keyword_counts") as keywords:
+    keywords.orderBy(F.desc("count")).show()
 
-# create a function that tokenises words
-def create_word_cloud_keywords(row):
-    words_tokenised = ''
-    for val in row:
-        # grab the word from selected column
-        text = val[0].lower()
-        # clear other punctuations except .
-        tokens = nltk.word_tokenize(text)
-        tokens = [word for word in tokens if word not in string.punctuation]
-        tokens = [word for word in tokens if word not in stopwords.words('english')]
-        # append selected keywords to words_tokenised
-        for words in tokens:
-            words_tokenised = words_tokenised + words + ' '
-    return words_tokenised
-
-"""By running create_word_cloud_keywords(), we should be able to obtain all the keywords of the list rows inputted. However, if we need to visualise this result, we must plot a WordCloud. Python has a package called wordcloud that creates this image for us. A WordCloud variable has a generate() method, that takes in tokens and outputs an image featuring the most used keywords.  """
+"""If we need to visualise this result, we must plot a WordCloud. Python has a package called wordcloud that creates this image for us. A WordCloud variable has a generate_from_frequencies() method, that takes in the keyword counts and outputs an image featuring the most used keywords.  """
 
 from wordcloud import WordCloud
-import string
 
 # generate WordClouds 
-pos_wordcloud = WordCloud(width=900, height=500, background_color ='white').generate(create_word_cloud_keywords(pos))
-neg_wordcloud = WordCloud(width=900, height=500, background_color ='white').generate(create_word_cloud_keywords(neg))
+with profiler.stage("generate_wordclouds"), planner.using("keyword_counts") as keywords:
+  pos_wordcloud = WordCloud(width=900, height=500, background_color ='white').generate_from_frequencies(frequencies_for(keywords, "pos"))
+  neg_wordcloud = WordCloud(width=900, height=500, background_color ='white').generate_from_frequencies(frequencies_for(keywords, "neg"))
 
 import matplotlib.pyplot as plt
 
@@ -476,29 +593,89 @@ plot_wordCloud(neg_wordcloud)
 Displays star ratings and sentiments side by side for products to see if and how they correlate - might be useful for businesses to understand customer's views
 """
 
+from metrics import SENTIMENTS
+
 #total number of postive,negative and null reviews for all the products 
-new_df = new_analysis_df.groupby("product_id","sent_score","star_rating").count()
-#transposes sent_score from row to column 
-new_df.groupBy("product_id","star_rating").pivot("sent_score").count().show()
+with profiler.stage("sentiment_pivot"), planner.using("new_analysis_df") as analysis:
+  #transposes sent_score from row to column; listing the tags saves a job to find them
+  new_df = analysis.groupBy("product_id","star_rating").pivot("sent_score", SENTIMENTS).count()
+  new_df.show()
+
+"""### Product Summary Table
+
+Questions about a single product, such as how many positive reviews it has or how its sentiments compare to its star ratings, shouldn't need a scan of every review. summarise_products() aggregates the scored reviews once into a table with a row per product, holding its review counts by star rating and by sentiment, its average star rating and its liked / disliked ratios. write_summary() stores it sorted by product_id with an index of the product_id range of every file, so a lookup only reads the one file that can hold the product.
+"""
+
+from product_summary import summarise_products, write_summary, ProductSummary
+
+product_summary_path = DATA_DIR + '/amazon_reviews_us_Jewelry_v1_00.product_summary.parquet'
+with profiler.stage("product_summary"), planner.using("scored_reviews") as scored:
+  write_summary(summarise_products(scored), product_summary_path)
+product_summary = ProductSummary(spark, product_summary_path)
+
+# look up the 5th most popular and the most popular products
+with profiler.stage("product_lookup"):
+  print(product_summary.lookup(product_id[4][0]))
+  print(product_summary.lookup(product_id[0][0]))
+
+"""### Rating and Sentiment Trends
+
+clean_reviews() parses every review_date into a date once, when the dataset is converted to Parquet. daily_rollups() counts the reviews, star ratings and sentiments of every product per day in one scan, and the rollups are saved partitioned by year. The weekly, monthly and yearly trends are then summed from the daily rollups rather than from the reviews, and a date range only reads the years it covers.
+"""
+
+import datetime
+from trends import daily_rollups, write_daily, load_daily, date_range, rollup, overall, with_rates, rolling_average, top_movers
+
+daily_rollups_path = DATA_DIR + '/amazon_reviews_us_Jewelry_v1_00.daily_rollups.parquet'
+with profiler.stage("daily_rollups"), planner.using("scored_reviews") as scored:
+  write_daily(daily_rollups(scored), daily_rollups_path)
+daily = load_daily(spark, daily_rollups_path)
+
+"""The monthly review volume, the average star rating over the last 3 months and the share of every sentiment, over all products."""
+
+with profiler.stage("monthly_trend") as record:
+  monthly = rolling_average(with_rates(overall(rollup(daily, "month"))), periods=3, key=None, level="month")
+  monthly_plot = record.to_driver(monthly.orderBy("period").select("period","reviews","rolling_avg_star_rating","pos_share","neu_share","neg_share").toPandas())
+
+monthly_plot.plot(x='period', y='reviews', kind='line', color='green')
+plt.show()
+monthly_plot.plot(x='period', y=['pos_share','neu_share','neg_share'], kind='area')
+plt.show()
+
+"""Products whose share of negative reviews spiked from one month to the next in 2015 (the last year of the dataset), among months with at least 10 reviews."""
+
+with profiler.stage("top_movers"):
+  monthly_products = rollup(date_range(daily, datetime.date(2015, 1, 1), datetime.date(2015, 12, 31)), "month")
+  top_movers(monthly_products, n=10, measure="neg_share", level="month").show()
 
 """### Comparison of sentiments with ratings
 
 Shows the number of sentiment review's the analyser was able to predict accurately by comparing with user given ratings
 """
 
-# select all reviews in the top 10000 records that are 5 stars and are positively rated
-pos_df = new_analysis_df.filter("sent_score='pos'")
-readings = spark.createDataFrame(pos_df.take(10000)).filter("star_rating >= 5")
+with profiler.stage("sample_sentiment_readings"), planner.using("new_analysis_df") as analysis:
+  # select all reviews in the sample of 10000 records that are 5 stars and are positively rated
+  pos_df = analysis.filter("sent_score='pos'")
+  readings = sample_reviews(pos_df, SAMPLE_SIZE, SAMPLE_METHOD).filter("star_rating >= 5")
+
+  # select all reviews in the sample of 10000 records that are 3 stars and are neutrally rated
+  neu_df = analysis.filter("sent_score='neu'")
+  readings2 = sample_reviews(neu_df, SAMPLE_SIZE, SAMPLE_METHOD).filter("star_rating = 3")
+
+
+  # select all reviews in the sample of 10000 records that are less than 2 stars and are negatively rated
+  neg_df = analysis.filter("sent_score='neg'")
+  readings3 = sample_reviews(neg_df, SAMPLE_SIZE, SAMPLE_METHOD).filter("star_rating <= 2")
+
+  print("Positive sentiments with 5 star rating for the %s %d records are %d." % (SAMPLE_METHOD, SAMPLE_SIZE, readings.count()))
+  print("Neutral sentinments at 3 star rating for the %s %d records are %d." % (SAMPLE_METHOD, SAMPLE_SIZE, readings2.count()))
+  print("Negative sentiments with less than 2 stars for the %s %d records are %d." % (SAMPLE_METHOD, SAMPLE_SIZE, readings3.count()))
 
-# select all reviews in the top 10000 records that are 3 stars and are neutrally rated
-neu_df = new_analysis_df.filter("sent_score='neu'")
-readings2 = spark.createDataFrame(neu_df.take(10000)).filter("star_rating = 3")
+"""Every dataframe registered with the planner has now been read by all of its consumers and released. The planner reports how many of the reads were served from the cache."""
 
+print(planner.report())
 
-# select all reviews in the top 10000 records that are less than 2 stars and are negatively rated
-neg_df = new_analysis_df.filter("sent_score='neg'")
-readings3 = spark.createDataFrame(neg_df.take(10000)).filter("star_rating <= 2")
+"""The profiled steps are saved in the Chrome trace format, which can be opened in chrome://tracing or https://ui.perfetto.dev. Steps that spend most of their wall time as driver CPU time, or that move many rows to the driver, stand out in the trace and the table below."""
 
-print("Positive sentiments with 5 star rating for the first 10000 records are %d." % readings.count())
-print("Neutral sentinments at 3 star rating for the first 10000 records are %d." % readings2.count())
-print("Negative sentiments with less than 2 stars for the first 10000 records are %d." % readings3.count())
+profiler.write_trace(DATA_DIR + '/bigdata_shared.trace.json')
+print(pd.DataFrame(profiler.summary())[["stage","wall_time_s","driver_cpu_time_s","driver_rows","input_bytes","shuffle_read_bytes","result_bytes"]])
@@ -0,0 +1,119 @@
+"""Spark-free building blocks shared by the Spark pipeline and local_engine.py.
+
+The star rating classes, the VADER sentiment tags, the review tokeniser and
+the confusion report only need the standard library, VADER and NLTK. They
+live here rather than in the modules that use them with Spark, so the local
+engine runs with pandas and without pyspark or pyarrow installed. aggregates,
+sentiment, metrics and keywords import them from here and re-export them.
+"""
+
+import string
+from dataclasses import dataclass
+
+import nltk
+
+STAR_RATINGS = [1, 2, 3, 4, 5]
+
+# positive reviews are rated 4 stars or more, negative reviews 2 stars or less
+POSITIVE_RATING = 4
+NEGATIVE_RATING = 2
+
+SENTIMENTS = ['pos', 'neu', 'neg']
+
+# reviews with a compound score at or beyond this value are tagged 'pos'/'neg'
+DEFAULT_THRESHOLD = 0.5
+
+PUNCTUATION = frozenset(string.punctuation)
+
+# one analyser per Python worker, created on first use
+_analyser = None
+
+
+def get_analyser():
+    """Return this worker's SentimentIntensityAnalyzer, creating it once."""
+    global _analyser
+    if _analyser is None:
+        from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+        _analyser = SentimentIntensityAnalyzer()
+    return _analyser
+
+
+def label_compound(score, threshold=DEFAULT_THRESHOLD):
+    """Map a VADER compound score to the 'pos', 'neu' or 'neg' tag."""
+    if score >= threshold:
+        return 'pos'
+    elif score <= -threshold:
+        return 'neg'
+    return 'neu'
+
+
+def english_stopwords():
+    """The NLTK English stopwords as a frozenset."""
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('english'))
+
+
+def tokenise_review(text, stop_words):
+    """Lower-case and tokenise a review, dropping punctuation and stopwords."""
+    return [token for token in nltk.word_tokenize(text.lower())
+            if token not in PUNCTUATION and token not in stop_words]
+
+
+def rating_class(star_rating):
+    """The sentiment class a star rating corresponds to."""
+    if star_rating >= 4:
+        return 'pos'
+    elif star_rating <= 2:
+        return 'neg'
+    return 'neu'
+
+
+@dataclass
+class ConfusionReport:
+    """Contingency table of sentiment tags against star ratings."""
+    # (sent_score, star_rating) -> number of reviews, for every tag and rating
+    table: dict
+
+    def count(self, sentiment=None, ratings=STAR_RATINGS):
+        """Number of reviews tagged sentiment (any tag if None) with one of the ratings."""
+        sentiments = SENTIMENTS if sentiment is None else [sentiment]
+        return sum(self.table[(s, r)] for s in sentiments for r in ratings)
+
+    def class_count(self, sentiment, rating_cls):
+        """Number of reviews tagged sentiment whose star rating belongs to rating_cls."""
+        return self.count(sentiment, [r for r in STAR_RATINGS if rating_class(r) == rating_cls])
+
+    def class_metrics(self):
+        """Precision, recall, F1 and support of every sentiment class."""
+        metrics = {}
+        for sentiment in SENTIMENTS:
+            true_pos = self.class_count(sentiment, sentiment)
+            predicted = self.count(sentiment)
+            actual = sum(self.class_count(s, sentiment) for s in SENTIMENTS)
+            precision = true_pos / predicted if predicted else 0.0
+            recall = true_pos / actual if actual else 0.0
+            f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            metrics[sentiment] = {'precision': precision, 'recall': recall, 'f1': f1, 'support': actual}
+        return metrics
+
+    def accuracy(self):
+        """Fraction of reviews whose sentiment tag matches the class of their rating."""
+        total = self.count()
+        if not total:
+            return 0.0
+        return sum(self.class_count(s, s) for s in SENTIMENTS) / total
+
+    def to_pandas(self):
+        """The contingency table with a row per sentiment tag and a column per star rating."""
+        import pandas as pd
+        return pd.DataFrame([[self.table[(s, r)] for r in STAR_RATINGS] for s in SENTIMENTS],
+                            index=SENTIMENTS, columns=STAR_RATINGS)
+
+
+def report_from_counts(counts):
+    """Build a ConfusionReport from (sent_score, star_rating, count) triples."""
+    table = {(s, r): 0 for s in SENTIMENTS for r in STAR_RATINGS}
+    for sentiment, rating, count in counts:
+        if (sentiment, rating) in table:
+            table[(sentiment, rating)] += count
+    return ConfusionReport(table)
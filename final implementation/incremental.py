@@ -0,0 +1,186 @@
+"""Incremental daily ingestion with checkpointed aggregates.
+
+New reviews land in one directory per day, named review_date=YYYY-MM-DD,
+under a source directory. Every run only reads the complete day partitions
+that have not been folded in yet, and merges their counts into the persisted
+per-product, per-customer and star rating tables (the same shapes as
+product_reviews, customer_reviews and ratings_df in the notebook). The
+sentiment of every new review is scored once and kept by review_id, so a
+review is never scored twice.
+
+A partition is complete once its day is over, or earlier when whatever
+writes it adds a _SUCCESS marker. Today's partition may still be receiving
+files, and a partition is never read again once it is folded in, so it
+waits for the next run otherwise.
+
+Everything is kept under a state directory:
+
+    state.json           processed partitions, watermark and table version
+    v<N>/<table>/        the current version of every aggregate table
+    sentiment/           compound score and sent_score by review_id
+
+A run writes the merged tables to a new version directory and only then
+switches state.json to it, so an interrupted run leaves the previous
+checkpoint intact.
+
+Usage: incremental.py <source dir> <state dir>
+"""
+
+import datetime
+import json
+import os
+import shutil
+import sys
+
+import pyspark.sql.functions as F
+from pyspark.sql import SparkSession
+
+from aggregates import product_aggregates, customer_aggregates
+from ingest import read_reviews_tsv, clean_reviews
+from sentiment import score_reviews
+
+PARTITION_PREFIX = "review_date="
+COMPLETE_MARKER = "_SUCCESS"
+STATE_FILE = "state.json"
+SENTIMENT_DIR = "sentiment"
+
+# table name -> key columns, every other column of the table is a count
+TABLE_KEYS = {
+    "product_reviews": ["product_id"],
+    "customer_reviews": ["customer_id"],
+    "ratings": ["star_rating"],
+}
+
+
+def read_state(state_dir):
+    """Return the checkpoint state, or an empty state before the first run."""
+    path = os.path.join(state_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {"processed_partitions": [], "watermark": None, "version": 0}
+    with open(path) as state_file:
+        return json.load(state_file)
+
+
+def write_state(state_dir, state):
+    """Atomically replace the checkpoint state."""
+    path = os.path.join(state_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def partition_complete(source_dir, partition, today):
+    """Whether no more files will land in a day partition: its day is before today, or it has a _SUCCESS marker."""
+    if os.path.exists(os.path.join(source_dir, partition, COMPLETE_MARKER)):
+        return True
+    return partition[len(PARTITION_PREFIX):] < today.isoformat()
+
+
+def pending_partitions(source_dir, state, today=None):
+    """Complete day partitions of source_dir that have not been processed yet, oldest first."""
+    processed = set(state["processed_partitions"])
+    today = today or datetime.date.today()
+    return sorted(name for name in os.listdir(source_dir)
+                  if name.startswith(PARTITION_PREFIX) and name not in processed
+                  and partition_complete(source_dir, name, today))
+
+
+def table_path(state_dir, version, table):
+    return os.path.join(state_dir, "v%d" % version, table)
+
+
+def load_tables(spark, state_dir):
+    """Load the current version of every aggregate table, as a dict of name -> DataFrame."""
+    state = read_state(state_dir)
+    if state["version"] == 0:
+        return {}
+    return {table: spark.read.parquet(table_path(state_dir, state["version"], table))
+            for table in TABLE_KEYS}
+
+
+def load_sentiment(spark, state_dir):
+    """Load the sentiment scores of every review folded in so far, or None before the first run."""
+    path = os.path.join(state_dir, SENTIMENT_DIR)
+    if not os.path.exists(path):
+        return None
+    return spark.read.parquet(path)
+
+
+def merge_counts(previous, new, keys):
+    """Add the count columns of new to those of previous, by key."""
+    if previous is None:
+        return new
+    counts = [column for column in new.columns if column not in keys]
+    return previous.unionByName(new) \
+                   .groupBy(*keys) \
+                   .agg(*[F.sum(column).alias(column) for column in counts])
+
+
+def score_new_reviews(spark, reviews, state_dir):
+    """Score the sentiment of the reviews whose review_id has not been scored yet."""
+    scored = load_sentiment(spark, state_dir)
+    if scored is not None:
+        reviews = reviews.join(scored.select("review_id"), "review_id", "left_anti")
+    score_reviews(reviews) \
+        .select("review_id", "product_id", "star_rating", "compound", "sent_score") \
+        .write.mode("append").parquet(os.path.join(state_dir, SENTIMENT_DIR))
+
+
+def run_incremental(spark, source_dir, state_dir, today=None):
+    """Fold the new complete day partitions of source_dir into the checkpointed tables.
+
+    Returns the list of partitions that were processed. today (a
+    datetime.date, the current day by default) decides which partitions are
+    complete without a _SUCCESS marker.
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    state = read_state(state_dir)
+    partitions = pending_partitions(source_dir, state, today)
+    if not partitions:
+        return []
+
+    reviews = clean_reviews(read_reviews_tsv(
+        spark, [os.path.join(source_dir, partition) for partition in partitions])).cache()
+
+    new_tables = {
+        "product_reviews": product_aggregates(reviews),
+        "customer_reviews": customer_aggregates(reviews),
+        "ratings": reviews.groupBy("star_rating").count().withColumnRenamed("count", "num_ratings"),
+    }
+    previous_tables = load_tables(spark, state_dir)
+
+    version = state["version"] + 1
+    for table, keys in TABLE_KEYS.items():
+        merge_counts(previous_tables.get(table), new_tables[table], keys) \
+            .write.mode("overwrite").parquet(table_path(state_dir, version, table))
+
+    score_new_reviews(spark, reviews, state_dir)
+    reviews.unpersist()
+
+    previous_version = state["version"]
+    state["processed_partitions"] = sorted(state["processed_partitions"] + partitions)
+    state["watermark"] = max([state["watermark"] or ""] +
+                             [partition[len(PARTITION_PREFIX):] for partition in partitions])
+    state["version"] = version
+    write_state(state_dir, state)
+
+    # the previous checkpoint is no longer referenced
+    if previous_version:
+        shutil.rmtree(os.path.join(state_dir, "v%d" % previous_version), ignore_errors=True)
+    return partitions
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: incremental <source dir> <state dir>", file=sys.stderr)
+        sys.exit(-1)
+
+    spark = SparkSession\
+        .builder\
+        .appName("Incremental Amazon Review Analysis")\
+        .getOrCreate()
+
+    processed = run_incremental(spark, sys.argv[1], sys.argv[2])
+    print("Folded in %d new partitions: %s" % (len(processed), ", ".join(processed)))
+
+    spark.stop()
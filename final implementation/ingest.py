@@ -0,0 +1,96 @@
+"""Columnar ingest layer for the Amazon customer reviews dataset.
+
+The raw review TSV is parsed once with the fixed Amazon reviews schema (no
+inferSchema pass), cleaned, and written as a Parquet dataset partitioned by
+star_rating. Later runs load the Parquet dataset, so filters such as
+star_rating >= 4 only read the matching partitions and only the selected
+columns are decoded.
+
+Spark decompresses .tsv.gz files on the fly while reading them, so the
+downloaded archive can be given directly without unzipping it first. Gzip is
+not splittable, so each .gz file is read by a single task; converting it to
+Parquet once means every later stage reads in parallel.
+
+Usage: ingest.py <reviews.tsv[.gz]> <parquet output dir>
+"""
+
+import os
+import sys
+
+import pyspark.sql.functions as F
+from pyspark.sql import SparkSession
+from pyspark.sql.types import StructType, StructField, StringType, IntegerType
+
+# schema of the tab separated files in https://s3.amazonaws.com/amazon-reviews-pds/tsv/
+REVIEW_SCHEMA = StructType([
+    StructField("marketplace", StringType()),
+    StructField("customer_id", StringType()),
+    StructField("review_id", StringType()),
+    StructField("product_id", StringType()),
+    StructField("product_parent", StringType()),
+    StructField("product_title", StringType()),
+    StructField("product_category", StringType()),
+    StructField("star_rating", IntegerType()),
+    StructField("helpful_votes", IntegerType()),
+    StructField("total_votes", IntegerType()),
+    StructField("vine", StringType()),
+    StructField("verified_purchase", StringType()),
+    StructField("review_headline", StringType()),
+    StructField("review_body", StringType()),
+    StructField("review_date", StringType()),
+])
+
+PARTITION_COLUMN = "star_rating"
+
+
+def read_reviews_tsv(spark, path):
+    """Read raw review TSV(.gz) file(s) with the explicit review schema.
+
+    Fields that don't match the schema (e.g. a malformed star_rating) are read as NULL.
+    """
+    return spark.read.csv(path, sep='\t', header=True, schema=REVIEW_SCHEMA, mode='PERMISSIVE')
+
+
+def clean_reviews(df):
+    """Keep only reviews with a valid star rating of 1 - 5, and parse their review_date."""
+    # dates are parsed once here, so every later step reads a DateType column
+    return df.filter(F.col("star_rating").between(1, 5)) \
+             .withColumn("review_date", F.to_date("review_date"))
+
+
+def convert_to_parquet(spark, source, destination, partition_by=PARTITION_COLUMN):
+    """Clean the raw review TSV(.gz) at source and write it as partitioned Parquet."""
+    clean_reviews(read_reviews_tsv(spark, source)) \
+        .repartition(partition_by) \
+        .write.mode('overwrite') \
+        .partitionBy(partition_by) \
+        .parquet(destination)
+
+
+def is_converted(path):
+    """Whether a complete Parquet dataset was written at path.
+
+    Spark only writes the _SUCCESS marker once every file of a write has
+    been committed, so an interrupted conversion doesn't count.
+    """
+    return os.path.exists(os.path.join(path, "_SUCCESS"))
+
+
+def load_reviews(spark, path):
+    """Load the cleaned, partitioned Parquet review dataset written by convert_to_parquet()."""
+    return spark.read.parquet(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: ingest <reviews.tsv[.gz]> <parquet output dir>", file=sys.stderr)
+        sys.exit(-1)
+
+    spark = SparkSession\
+        .builder\
+        .appName("Amazon Review Ingest")\
+        .getOrCreate()
+
+    convert_to_parquet(spark, sys.argv[1], sys.argv[2])
+
+    spark.stop()
@@ -0,0 +1,78 @@
+"""Distributed keyword frequencies for the sentiment WordClouds.
+
+Review bodies are tokenised on the executors with NLTK, using a broadcast
+frozenset of the English stopwords. Every partition counts its own
+(sentiment, term) pairs before anything is shuffled, and the merged counts
+are reduced to the top_n terms of each sentiment with bounded heaps, so only
+a small frequency table ever reaches the driver.
+WordCloud.generate_from_frequencies() draws directly from that table.
+"""
+
+import heapq
+from collections import Counter
+from operator import add
+
+import pyspark.sql.functions as F
+from pyspark.sql.types import StructType, StructField, StringType, LongType
+
+from common import english_stopwords, tokenise_review
+from profiling import to_driver
+
+FREQUENCY_SCHEMA = StructType([
+    StructField("sentiment", StringType()),
+    StructField("term", StringType()),
+    StructField("count", LongType()),
+])
+
+
+def keyword_frequencies(df, top_n=200, text_col='review_body', label_col='sent_score',
+                        sentiments=('pos', 'neg'), group_col=None):
+    """Count the terms of the reviews of every sentiment in df.
+
+    Returns a DataFrame of (sentiment, term, count) holding the top_n most
+    frequent terms of each of the sentiments. With a group_col, such as a
+    category, the terms of every group are counted and ranked separately in
+    the same pass, and group_col comes first.
+    """
+    keys = [group_col, label_col] if group_col else [label_col]
+    spark = df.sql_ctx.sparkSession
+    stop_words = spark.sparkContext.broadcast(english_stopwords())
+
+    def count_partition(rows):
+        # combine the counts of the partition before they are shuffled
+        counts = Counter()
+        stops = stop_words.value
+        for row in rows:
+            key, text = tuple(row[:-1]), row[-1]
+            for token in tokenise_review(text, stops):
+                counts[(key, token)] += 1
+        return counts.items()
+
+    def add_term(heap, term_count):
+        if len(heap) < top_n:
+            heapq.heappush(heap, term_count)
+        elif term_count > heap[0]:
+            heapq.heapreplace(heap, term_count)
+        return heap
+
+    def merge_heaps(left, right):
+        return heapq.nlargest(top_n, left + right)
+
+    top_terms = df.filter(F.col(label_col).isin(*sentiments) & F.col(text_col).isNotNull()) \
+                  .select(*keys, text_col).rdd \
+                  .mapPartitions(count_partition) \
+                  .reduceByKey(add) \
+                  .map(lambda pair: (pair[0][0], (pair[1], pair[0][1]))) \
+                  .aggregateByKey([], add_term, merge_heaps) \
+                  .flatMap(lambda pair: [pair[0] + (term, count) for count, term in pair[1]])
+
+    schema = FREQUENCY_SCHEMA
+    if group_col:
+        schema = StructType([StructField(group_col, df.schema[group_col].dataType)] + FREQUENCY_SCHEMA.fields)
+    return spark.createDataFrame(top_terms, schema)
+
+
+def frequencies_for(frequencies, sentiment):
+    """The term -> count dict of one sentiment, as used by WordCloud.generate_from_frequencies()."""
+    rows = to_driver(frequencies.filter(F.col("sentiment") == sentiment).collect())
+    return {row.term: row['count'] for row in rows}
@@ -0,0 +1,215 @@
+"""Single-machine execution of the review analysis with pandas, without Spark.
+
+For small and medium categories, starting a JVM (and, on Colab, installing
+a JDK and Spark) takes longer than the analysis itself. analyse_reviews()
+computes the same statistics as the Spark pipeline in one streaming pass
+over the review TSV(.gz):
+
+* the rating histogram, the per-product and per-customer review counts and
+  the top-K products and customers (as build_report() and topk.py),
+* the VADER sentiment tags and their confusion matrix against the star
+  ratings (as sentiment.py and metrics.py),
+* the keyword frequencies of the positive and negative reviews (as
+  keywords.py).
+
+The file is read in chunks of chunk_size reviews with compact typed columns:
+product_id and customer_id as categoricals and star_rating as int8. Every
+chunk is reduced to counts with vectorised bincount and groupby aggregations
+and then dropped, so peak memory is bounded by the chunk size plus the
+per-product and per-customer tables.
+
+Usage: local_engine.py <reviews.tsv[.gz]> [--output report.json] [--top 5] [--chunk-size N] [--no-sentiment]
+"""
+
+import argparse
+import csv
+import json
+from collections import Counter
+from dataclasses import dataclass
+
+import nltk
+import numpy as np
+import pandas as pd
+
+from common import (STAR_RATINGS, POSITIVE_RATING, NEGATIVE_RATING, DEFAULT_THRESHOLD, ConfusionReport,
+                    english_stopwords, get_analyser, label_compound, report_from_counts, tokenise_review)
+
+DEFAULT_CHUNK_SIZE = 100000
+STAR_COLUMNS = ["star_%d" % star for star in STAR_RATINGS]
+
+READ_DTYPES = {
+    "customer_id": "category",
+    "product_id": "category",
+    # parsed to int8 after dropping invalid ratings
+    "star_rating": "string",
+    "review_body": "string",
+}
+
+
+def read_review_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE, columns=tuple(READ_DTYPES)):
+    """Yield the valid reviews of the review TSV(.gz) at path as pandas DataFrames of chunk_size rows.
+
+    Like ingest.clean_reviews(), reviews without a star rating from 1 to 5
+    are dropped.
+    """
+    reader = pd.read_csv(path, sep="\t", usecols=list(columns),
+                         dtype={column: READ_DTYPES[column] for column in columns},
+                         quoting=csv.QUOTE_NONE, on_bad_lines="skip", chunksize=chunk_size)
+    for chunk in reader:
+        stars = pd.to_numeric(chunk["star_rating"], errors="coerce")
+        chunk = chunk[stars.between(1, 5)]
+        chunk = chunk.assign(star_rating=stars[stars.between(1, 5)].astype(np.int8))
+        yield chunk
+
+
+def count_by_key(keys, stars=None):
+    """Review counts of every key of a categorical Series, per star rating if stars is given."""
+    keys = keys.cat.remove_unused_categories()
+    codes = keys.cat.codes.to_numpy().astype(np.int64)
+    valid = codes >= 0
+    codes = codes[valid]
+    categories = keys.cat.categories
+    if stars is None:
+        return pd.Series(np.bincount(codes, minlength=len(categories)), index=categories)
+    cells = codes * len(STAR_RATINGS) + (stars[valid] - 1)
+    counts = np.bincount(cells, minlength=len(categories) * len(STAR_RATINGS))
+    return pd.DataFrame(counts.reshape(-1, len(STAR_RATINGS)), index=categories, columns=STAR_COLUMNS)
+
+
+def _accumulate(total, counts):
+    if total is None:
+        return counts
+    return total.add(counts, fill_value=0)
+
+
+def top_k(table, column, k):
+    """The k rows of a local table with the highest values of column."""
+    return table.nlargest(k, column)
+
+
+@dataclass
+class LocalReport:
+    """The statistics of a review file, computed by analyse_reviews()."""
+    total_reviews: int
+    num_products: int
+    # star rating -> number of reviews, with every rating from 1 to 5 present
+    rating_histogram: dict
+    # indexed by product_id: product_reviews, positive_reviews, negative_reviews, star_1 ... star_5
+    product_reviews: pd.DataFrame
+    # indexed by customer_id: customer_reviews
+    customer_reviews: pd.DataFrame
+    # None when the sentiment analysis was skipped
+    confusion: ConfusionReport = None
+    # sentiment -> Counter of term -> count
+    keywords: dict = None
+
+    def product(self, product_id):
+        """Return the product_reviews row of product_id, or None if it has no reviews."""
+        if product_id not in self.product_reviews.index:
+            return None
+        return self.product_reviews.loc[product_id]
+
+    def liked_ratio(self, product_id):
+        """Fraction of the reviews of product_id that are positive."""
+        product = self.product(product_id)
+        if product is None or product.product_reviews == 0:
+            return 0.0
+        return product.positive_reviews / product.product_reviews
+
+    def disliked_ratio(self, product_id):
+        """Fraction of the reviews of product_id that are negative."""
+        product = self.product(product_id)
+        if product is None or product.product_reviews == 0:
+            return 0.0
+        return product.negative_reviews / product.product_reviews
+
+    def frequencies_for(self, sentiment, top_n=200):
+        """The top_n term -> count dict of one sentiment, for WordCloud.generate_from_frequencies()."""
+        return dict(self.keywords[sentiment].most_common(top_n))
+
+
+def analyse_reviews(path, chunk_size=DEFAULT_CHUNK_SIZE, sentiment=True, keywords=True,
+                    threshold=DEFAULT_THRESHOLD, sentiments=("pos", "neg")):
+    """Analyse the review TSV(.gz) at path in one pass of chunk_size reviews at a time."""
+    histogram = np.zeros(len(STAR_RATINGS), dtype=np.int64)
+    products = customers = None
+    confusion_counts = Counter()
+    keyword_counts = {label: Counter() for label in sentiments}
+    columns = ["customer_id", "product_id", "star_rating"] + (["review_body"] if sentiment else [])
+    analyser = get_analyser() if sentiment else None
+    stop_words = english_stopwords() if sentiment and keywords else None
+
+    for chunk in read_review_chunks(path, chunk_size, columns):
+        stars = chunk["star_rating"].to_numpy()
+        histogram += np.bincount(stars - 1, minlength=len(STAR_RATINGS))
+        products = _accumulate(products, count_by_key(chunk["product_id"], stars))
+        customers = _accumulate(customers, count_by_key(chunk["customer_id"]))
+
+        if sentiment:
+            bodies = chunk[["review_body", "star_rating"]].dropna(subset=["review_body"])
+            labels = pd.Series([label_compound(analyser.polarity_scores(text)["compound"], threshold)
+                                for text in bodies["review_body"]], index=bodies.index)
+            for (label, star), count in bodies.groupby([labels, "star_rating"]).size().items():
+                confusion_counts[(label, star)] += count
+            if keywords:
+                for label, text in zip(labels, bodies["review_body"]):
+                    if label in keyword_counts:
+                        keyword_counts[label].update(tokenise_review(text, stop_words))
+
+    if products is None:
+        products = pd.DataFrame(columns=STAR_COLUMNS, dtype=np.int64)
+        customers = pd.Series(dtype=np.int64)
+    products = products.astype(np.int64)
+    products.insert(0, "product_reviews", products[STAR_COLUMNS].sum(axis=1))
+    products.insert(1, "positive_reviews",
+                    products[["star_%d" % star for star in STAR_RATINGS if star >= POSITIVE_RATING]].sum(axis=1))
+    products.insert(2, "negative_reviews",
+                    products[["star_%d" % star for star in STAR_RATINGS if star <= NEGATIVE_RATING]].sum(axis=1))
+    products.index.name = "product_id"
+    customers = customers.astype(np.int64).rename("customer_reviews").to_frame()
+    customers.index.name = "customer_id"
+
+    return LocalReport(
+        total_reviews=int(histogram.sum()),
+        num_products=len(products),
+        rating_histogram={star: int(count) for star, count in zip(STAR_RATINGS, histogram)},
+        product_reviews=products,
+        customer_reviews=customers,
+        confusion=report_from_counts((label, star, count) for (label, star), count
+                                     in confusion_counts.items()) if sentiment else None,
+        keywords=keyword_counts if sentiment and keywords else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse an Amazon review file without Spark")
+    parser.add_argument("path", help="review TSV(.gz) file")
+    parser.add_argument("--output", default="local_report.json")
+    parser.add_argument("--top", type=int, default=5, help="number of top products and customers")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--no-sentiment", action="store_true", help="skip the sentiment analysis")
+    args = parser.parse_args()
+
+    if not args.no_sentiment:
+        # the keywords are tokenised with punkt and filtered with the stopwords corpus
+        nltk.download('stopwords', quiet=True)
+        nltk.download('punkt', quiet=True)
+    report = analyse_reviews(args.path, args.chunk_size, not args.no_sentiment)
+    output = {
+        "total_reviews": report.total_reviews,
+        "num_products": report.num_products,
+        "num_customers": len(report.customer_reviews),
+        "rating_histogram": report.rating_histogram,
+    }
+    for column in ["product_reviews", "positive_reviews", "negative_reviews"]:
+        output["top_" + column] = top_k(report.product_reviews, column, args.top)[column].to_dict()
+    output["top_customers"] = top_k(report.customer_reviews, "customer_reviews", args.top)["customer_reviews"].to_dict()
+    if report.confusion is not None:
+        output["confusion_matrix"] = {sent: {star: report.confusion.table[(sent, star)] for star in STAR_RATINGS}
+                                      for sent in ["pos", "neu", "neg"]}
+        output["class_metrics"] = report.confusion.class_metrics()
+        output["accuracy"] = report.confusion.accuracy()
+        output["keywords"] = {label: report.frequencies_for(label, 20) for label in report.keywords}
+
+    with open(args.output, "w") as output_file:
+        json.dump(output, output_file, indent=2, default=int)
+    print("%d reviews, %d products" % (report.total_reviews, report.num_products))
@@ -0,0 +1,55 @@
+"""Confusion matrix and classifier metrics for the sentiment analysis.
+
+confusion_matrix() counts every (sentiment tag, star rating) pair in one
+aggregation, giving the full 3x5 contingency table from which the true/false
+positive and negative counts and the per-class precision, recall and F1 are
+derived on the driver. Star ratings are mapped to classes the same way as in
+the rest of the analysis: 4 and 5 stars are positive, 3 stars neutral and
+1 and 2 stars negative.
+
+threshold_sweep() evaluates the VADER 'compound' cutoff used to tag reviews
+(+-0.5 by default) at many thresholds. It aggregates a histogram of compound
+scores per star rating once, so no review is scored again for each threshold.
+"""
+
+import pyspark.sql.functions as F
+
+from common import SENTIMENTS, STAR_RATINGS, ConfusionReport, label_compound, rating_class, report_from_counts
+from profiling import to_driver
+
+# VADER compound scores are rounded to 4 decimals, so this resolution is exact
+COMPOUND_RESOLUTION = 10000
+
+
+def confusion_matrix(df, rating_col='star_rating', pred_col='sent_score'):
+    """Compute the sentiment x star rating contingency table of df in one aggregation."""
+    counts = to_driver(df.groupBy(pred_col, rating_col).count().collect())
+    return report_from_counts((row[0], row[1], row[2]) for row in counts)
+
+
+def compound_histogram(df, rating_col='star_rating', compound_col='compound',
+                       resolution=COMPOUND_RESOLUTION):
+    """Count the reviews of every (star rating, compound score bucket) pair.
+
+    Returns a dict mapping (star_rating, bucket) to a count, where bucket is
+    the compound score multiplied by resolution and rounded.
+    """
+    buckets = to_driver(df.filter(F.col(compound_col).isNotNull())
+                          .groupBy(rating_col, F.round(F.col(compound_col) * resolution).cast('int'))
+                          .count().collect())
+    return {(row[0], row[1]): row[2] for row in buckets}
+
+
+def sweep_histogram(histogram, thresholds, resolution=COMPOUND_RESOLUTION):
+    """Evaluate a compound_histogram() at every threshold, returning threshold -> ConfusionReport."""
+    return {threshold: report_from_counts(
+                (label_compound(bucket / resolution, threshold), rating, count)
+                for (rating, bucket), count in histogram.items())
+            for threshold in thresholds}
+
+
+def threshold_sweep(df, thresholds, rating_col='star_rating', compound_col='compound',
+                    resolution=COMPOUND_RESOLUTION):
+    """Confusion reports of the sentiment tags obtained with every compound threshold."""
+    histogram = compound_histogram(df, rating_col, compound_col, resolution)
+    return sweep_histogram(histogram, thresholds, resolution)
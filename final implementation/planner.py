@@ -0,0 +1,139 @@
+"""Caching and persistence planner for DataFrames reused by the analysis.
+
+Intermediate datasets are registered by name together with the number of
+downstream actions that will consume them. Every consumer reads the
+dataset inside a planner.using(name) block. A dataset consumed more than
+once is persisted when it is first used, at a storage level picked from
+its estimated size: in memory when it fits comfortably in the storage
+memory of the executors, in memory spilling to disk when it might not,
+and on disk when it is larger than the storage memory. The dataset is
+unpersisted as soon as its last consumer is done with it, so cached data
+never outlives its readers.
+
+Every use is logged as a cache hit (the data was already materialised) or
+miss, along with the in-memory and on-disk size of the cached data. The
+report warns about every dataset whose consumers weren't all used (it was
+never released) or that was used more often than registered (it was
+released before its last reads).
+"""
+
+import logging
+from contextlib import contextmanager
+
+from pyspark import StorageLevel
+
+logger = logging.getLogger(__name__)
+
+# persist in memory only while the estimated size is under this share of the storage memory
+MEMORY_SHARE = 0.5
+
+
+class PlannedDataset:
+    """A registered DataFrame and how many of its consumers are still to come."""
+
+    def __init__(self, name, df, consumers):
+        self.name = name
+        self.df = df
+        self.remaining = consumers
+        self.storage_level = None
+        self.hits = 0
+        self.misses = 0
+
+
+class ExecutionPlanner:
+    """Persist registered DataFrames while they have consumers left, and release them after."""
+
+    def __init__(self, spark, memory_share=MEMORY_SHARE):
+        self.spark = spark
+        self.memory_share = memory_share
+        self.datasets = {}
+
+    def register(self, name, df, consumers):
+        """Register df under name, to be used by the given number of downstream actions."""
+        self.datasets[name] = PlannedDataset(name, df, consumers)
+        return df
+
+    def storage_memory(self):
+        """Total storage memory of the executors (the driver in local mode), in bytes."""
+        status = self.spark.sparkContext._jsc.sc().getExecutorMemoryStatus()
+        total, values = 0, status.values().iterator()
+        while values.hasNext():
+            total += values.next()._1()
+        return total
+
+    def estimated_size(self, df):
+        """Catalyst's estimate of the size of df, in bytes."""
+        return int(df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes().toString())
+
+    def choose_storage_level(self, df):
+        size, memory = self.estimated_size(df), self.storage_memory()
+        if size <= memory * self.memory_share:
+            return StorageLevel.MEMORY_ONLY
+        elif size <= memory:
+            return StorageLevel.MEMORY_AND_DISK
+        return StorageLevel.DISK_ONLY
+
+    def cached_size(self, df):
+        """(memory bytes, disk bytes) of the materialised cache of df, or None if it isn't."""
+        cache_manager = self.spark._jsparkSession.sharedState().cacheManager()
+        cached = cache_manager.lookupCachedData(df._jdf.queryExecution().analyzed())
+        if cached.isEmpty():
+            return None
+        builder = cached.get().cachedRepresentation().cacheBuilder()
+        if not builder.isCachedColumnBuffersLoaded():
+            return None
+        rdd_id = builder.cachedColumnBuffers().id()
+        for info in self.spark.sparkContext._jsc.sc().getRDDStorageInfo():
+            if info.id() == rdd_id:
+                return info.memSize(), info.diskSize()
+        return None
+
+    def use(self, name):
+        """Return the DataFrame registered as name for one of its consumers."""
+        dataset = self.datasets[name]
+        if dataset.remaining > 1 and dataset.storage_level is None:
+            dataset.storage_level = self.choose_storage_level(dataset.df)
+            dataset.df.persist(dataset.storage_level)
+            logger.info("persisting %s at %s", name, dataset.storage_level)
+
+        if dataset.storage_level is not None:
+            sizes = self.cached_size(dataset.df)
+            if sizes is None:
+                dataset.misses += 1
+                logger.info("cache miss for %s", name)
+            else:
+                dataset.hits += 1
+                logger.info("cache hit for %s (%d bytes in memory, %d bytes on disk)",
+                            name, sizes[0], sizes[1])
+        return dataset.df
+
+    def done(self, name):
+        """Record that one consumer of name has finished; unpersist it after the last."""
+        dataset = self.datasets[name]
+        dataset.remaining -= 1
+        if dataset.remaining <= 0 and dataset.storage_level is not None:
+            dataset.df.unpersist()
+            dataset.storage_level = None
+            logger.info("released %s after %d hits and %d misses", name, dataset.hits, dataset.misses)
+
+    @contextmanager
+    def using(self, name):
+        """Context in which one consumer of name uses the DataFrame it yields."""
+        try:
+            yield self.use(name)
+        finally:
+            self.done(name)
+
+    def report(self):
+        """Consumers left, storage level, hits and misses of every registered dataset."""
+        for name, dataset in self.datasets.items():
+            if dataset.remaining > 0:
+                logger.warning("%s still has %d of its consumers left, so it was never released",
+                               name, dataset.remaining)
+            elif dataset.remaining < 0:
+                logger.warning("%s was used by %d more consumers than registered, so it was released "
+                               "before they read it", name, -dataset.remaining)
+        return {name: {"remaining": dataset.remaining,
+                       "storage_level": str(dataset.storage_level) if dataset.storage_level else None,
+                       "hits": dataset.hits, "misses": dataset.misses}
+                for name, dataset in self.datasets.items()}
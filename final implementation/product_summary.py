@@ -0,0 +1,92 @@
+"""Materialised per-product summary table with a product_id index.
+
+summarise_products() aggregates the scored reviews once into a table with
+a row per product, holding the review counts by star rating and by
+sentiment tag, the average star rating and the liked / disliked ratios.
+The sentiment counts are conditional counts over the known tags, so unlike
+pivot("sent_score") no extra job is needed to find the distinct tags.
+
+write_summary() range partitions the table by product_id and sorts every
+file by it, and saves the smallest and largest product_id of every file in
+an index next to it. ProductSummary.lookup() only reads the file whose
+range holds the product, where Parquet's row group statistics skip most of
+the rows, so answering "how many positive reviews does this product have"
+never scans the raw reviews.
+"""
+
+import bisect
+import json
+import os
+
+import pyspark.sql.functions as F
+
+from aggregates import count_if, product_count_columns
+from metrics import SENTIMENTS
+from profiling import to_driver
+
+INDEX_FILE = "_product_index.json"
+DEFAULT_FILES = 16
+
+
+def summarise_products(df):
+    """Per-product counts by star and sentiment, average rating and liked/disliked ratios.
+
+    df holds the reviews with their 'sent_score' tag (NULL when a review
+    couldn't be scored), such as the output of score_with_cache().
+    """
+    sentiment = F.col("sent_score")
+    return df.groupBy("product_id").agg(
+        *product_count_columns(),
+        *[count_if(sentiment == label).alias("%s_sentiment" % label) for label in SENTIMENTS],
+        F.avg("star_rating").alias("avg_star_rating")) \
+        .withColumn("liked_ratio", F.col("positive_reviews") / F.col("product_reviews")) \
+        .withColumn("disliked_ratio", F.col("negative_reviews") / F.col("product_reviews"))
+
+
+def write_summary(summary, path, files=DEFAULT_FILES):
+    """Write summary sorted by product_id into files range-partitioned files, and index them."""
+    summary.repartitionByRange(files, "product_id") \
+           .sortWithinPartitions("product_id") \
+           .write.mode("overwrite").parquet(path)
+
+    spark = summary.sql_ctx.sparkSession
+    # only the product_id column of the small summary table is read to build the index
+    ranges = to_driver(spark.read.parquet(path)
+                            .groupBy(F.input_file_name().alias("file"))
+                            .agg(F.min("product_id").alias("first"), F.max("product_id").alias("last"))
+                            .collect())
+    index = sorted([row.first, row.last, row.file] for row in ranges)
+    with open(os.path.join(path, INDEX_FILE), "w") as index_file:
+        json.dump(index, index_file)
+    return index
+
+
+class ProductSummary:
+    """Point lookups of the product summary table written by write_summary()."""
+
+    def __init__(self, spark, path):
+        self.spark = spark
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as index_file:
+            self.index = json.load(index_file)
+        self._firsts = [first for first, _, _ in self.index]
+
+    def table(self):
+        """The whole summary table."""
+        return self.spark.read.parquet(self.path)
+
+    def file_for(self, product_id):
+        """The file holding product_id, or None if no file's range holds it."""
+        position = bisect.bisect_right(self._firsts, product_id) - 1
+        if position < 0:
+            return None
+        first, last, path = self.index[position]
+        return path if product_id <= last else None
+
+    def lookup(self, product_id):
+        """The summary row of product_id, or None if it has no reviews."""
+        path = self.file_for(product_id)
+        if path is None:
+            return None
+        rows = to_driver(self.spark.read.parquet(path).filter(F.col("product_id") == product_id).take(1))
+        return rows[0] if rows else None
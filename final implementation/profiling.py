@@ -0,0 +1,180 @@
+"""Instrumentation of the steps of the review analysis.
+
+Every step runs inside a named profiler.stage(name) context, which puts the
+Spark jobs it starts in their own job group. On exit it records:
+
+* the wall time, and the CPU time of the Python driver (high for steps
+  that loop over rows on the driver rather than on the executors),
+* the ids of the Spark jobs and stages it ran,
+* the input, output and shuffle bytes of those stages, and the bytes of
+  task results sent back to the driver (from the Spark UI REST API),
+* the rows moved to the driver, counted by passing what the step collects
+  through record.to_driver(). Library functions that collect for a step
+  pass their rows through to_driver(), which counts them for the innermost
+  step that is running.
+
+write_trace() saves the steps in the Chrome trace event format, which can
+be opened in chrome://tracing or https://ui.perfetto.dev. Steps nested in
+other steps show up nested in the trace; the Spark jobs of a nested step
+are only counted in that step.
+
+Usage:
+
+    profiler = Profiler(spark)
+    with profiler.stage("top_k") as record:
+        rows = record.to_driver(df.take(5))
+    profiler.write_trace("trace.json")
+"""
+
+import json
+import os
+import time
+import urllib.request
+from contextlib import contextmanager
+
+STAGE_METRICS = {
+    "input_bytes": "inputBytes",
+    "output_bytes": "outputBytes",
+    "shuffle_read_bytes": "shuffleReadBytes",
+    "shuffle_write_bytes": "shuffleWriteBytes",
+    "result_bytes": "resultSize",
+}
+
+
+def rest(spark, endpoint):
+    """GET an endpoint of the Spark UI REST API for the current application.
+
+    Raises OSError when the request fails, and when the UI is disabled
+    (spark.ui.enabled=false), in which case there is no URL to request.
+    """
+    ui_url = spark.sparkContext.uiWebUrl
+    if ui_url is None:
+        raise OSError("the Spark UI is disabled")
+    url = "%s/api/v1/applications/%s/%s" % (ui_url, spark.sparkContext.applicationId, endpoint)
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+
+def group_stages(spark, group):
+    """The job ids of a job group, and the stage ids of those jobs."""
+    tracker = spark.sparkContext.statusTracker()
+    job_ids = sorted(tracker.getJobIdsForGroup(group))
+    stage_ids = []
+    for job_id in job_ids:
+        info = tracker.getJobInfo(job_id)
+        if info is not None:
+            stage_ids.extend(info.stageIds)
+    return job_ids, sorted(set(stage_ids))
+
+
+def stage_bytes(spark, stage_ids):
+    """Total input, output, shuffle and result bytes of the given Spark stages.
+
+    They are all 0 when the Spark UI is disabled.
+    """
+    totals = dict.fromkeys(STAGE_METRICS, 0)
+    if spark.sparkContext.uiWebUrl is None:
+        return totals
+    for stage_id in stage_ids:
+        try:
+            attempts = rest(spark, "stages/%d" % stage_id)
+        except OSError:
+            # skipped stages (whose shuffle output was reused) have no metrics
+            continue
+        for attempt in attempts:
+            for metric, field in STAGE_METRICS.items():
+                totals[metric] += attempt.get(field, 0)
+    return totals
+
+
+# the records of the steps running right now, innermost last
+_running = []
+
+
+def to_driver(rows):
+    """Count rows as moved to the driver by the innermost running step, if any, and return them."""
+    if _running:
+        _running[-1].to_driver(rows)
+    return rows
+
+
+class StageRecord:
+    """Measurements of one profiled step."""
+
+    def __init__(self, name, group, parent=None):
+        self.name = name
+        self.group = group
+        self.parent = parent
+        self.driver_rows = 0
+        self.start = None
+        self.wall_time = None
+        self.cpu_time = None
+        self.job_ids = []
+        self.stage_ids = []
+        self.metrics = {}
+
+    def to_driver(self, rows):
+        """Count rows (a list of collected rows) as moved to the driver, and return them."""
+        self.driver_rows += len(rows)
+        return rows
+
+    def to_dict(self):
+        return {"stage": self.name, "parent": self.parent, "wall_time_s": self.wall_time,
+                "driver_cpu_time_s": self.cpu_time, "driver_rows": self.driver_rows,
+                "job_ids": self.job_ids, "stage_ids": self.stage_ids, **self.metrics}
+
+
+class Profiler:
+    """Records a StageRecord for every step run in a stage() context."""
+
+    def __init__(self, spark):
+        self.spark = spark
+        self.records = []
+        self._active = []
+        self._started = 0
+        self._origin = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        context = self.spark.sparkContext
+        self._started += 1
+        record = StageRecord(name, "%s-%d" % (name, self._started),
+                             self._active[-1].name if self._active else None)
+        previous_group = context.getLocalProperty("spark.jobGroup.id")
+        previous_description = context.getLocalProperty("spark.job.description")
+        context.setJobGroup(record.group, name)
+        self._active.append(record)
+        _running.append(record)
+
+        record.start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_time = time.perf_counter() - record.start
+            record.cpu_time = time.process_time() - cpu_start
+            self._active.pop()
+            _running.remove(record)
+            # jobs of the steps around this one go back to their own group
+            context.setLocalProperty("spark.jobGroup.id", previous_group)
+            context.setLocalProperty("spark.job.description", previous_description)
+
+            record.job_ids, record.stage_ids = group_stages(self.spark, record.group)
+            record.metrics = stage_bytes(self.spark, record.stage_ids)
+            self.records.append(record)
+
+    def summary(self):
+        """The records of every step, in the order they finished, as dicts."""
+        return [record.to_dict() for record in self.records]
+
+    def trace_events(self):
+        """The steps as Chrome trace 'complete' events, timestamps in microseconds."""
+        pid = os.getpid()
+        return [{"name": record.name, "cat": "stage", "ph": "X", "pid": pid, "tid": 0,
+                 "ts": (record.start - self._origin) * 1e6, "dur": record.wall_time * 1e6,
+                 "args": record.to_dict()}
+                for record in sorted(self.records, key=lambda record: record.start)]
+
+    def write_trace(self, path):
+        with open(path, "w") as trace:
+            json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, trace, indent=1)
@@ -0,0 +1,84 @@
+"""Distributed samples of the reviews.
+
+Taking rows to the driver and turning them back into a DataFrame pickles
+every row through Python and loses the schema. The samples below are
+DataFrames that stay on the executors:
+
+* first_n(): the first n reviews, ordered by a key when given so repeated
+  runs return the same reviews. Without one, the first reviews of a
+  Parquet dataset partitioned by star_rating mostly share one rating,
+  so sample_reviews() orders them by review_id,
+* stratified_sample(): about n reviews with every star rating represented
+  in proportion to the whole dataset (or equally, with balanced=True),
+* fraction_sample(): a seeded uniform sample of about n reviews.
+
+sample_reviews() picks one of them by name, so whether an analysis looks at
+the "first N" or a "representative N" reviews is a parameter.
+"""
+
+from profiling import to_driver
+
+SAMPLE_METHODS = ["first", "stratified", "random"]
+DEFAULT_SEED = 751
+# review ids are unique and unrelated to the rating, so the first reviews by id mix every rating
+FIRST_ORDER = "review_id"
+
+
+def first_n(df, n, order_by=None):
+    """The first n rows of df, ordered by the column order_by if given."""
+    if order_by is not None:
+        df = df.orderBy(order_by)
+    return df.limit(n)
+
+
+def stratum_counts(df, column):
+    """The number of rows of df for every value of column, as a dict."""
+    return {row[column]: row["count"] for row in to_driver(df.groupBy(column).count().collect())}
+
+
+def stratified_sample(df, n, column="star_rating", counts=None, balanced=False, seed=DEFAULT_SEED):
+    """About n rows of df, sampled separately from every value of column.
+
+    Every value gets a share of the n rows in proportion to its count, or
+    the same share with balanced=True (smaller strata are then taken
+    whole). counts maps every value of column to its number of rows, e.g.
+    ReviewReport.rating_histogram for the star ratings; it is counted from
+    df when not given.
+    """
+    if counts is None:
+        counts = stratum_counts(df, column)
+    counts = {value: count for value, count in counts.items() if count}
+    total = sum(counts.values())
+    if not total:
+        return df.limit(0)
+
+    fractions = {}
+    for value, count in counts.items():
+        target = n / len(counts) if balanced else n * count / total
+        fractions[value] = min(1.0, target / count)
+    return df.sampleBy(column, fractions, seed)
+
+
+def fraction_sample(df, n, total=None, seed=DEFAULT_SEED):
+    """A seeded uniform sample of about n of the total rows of df (counted when not given)."""
+    if total is None:
+        total = df.count()
+    if not total:
+        return df.limit(0)
+    return df.sample(fraction=min(1.0, n / total), seed=seed)
+
+
+def sample_reviews(df, n, method="first", counts=None, seed=DEFAULT_SEED):
+    """About n reviews of df, sampled with one of SAMPLE_METHODS.
+
+    counts is the star rating histogram of df (e.g.
+    ReviewReport.rating_histogram), which saves counting df for the
+    'stratified' and 'random' samples.
+    """
+    if method == "first":
+        return first_n(df, n, FIRST_ORDER)
+    elif method == "stratified":
+        return stratified_sample(df, n, "star_rating", counts, seed=seed)
+    elif method == "random":
+        return fraction_sample(df, n, sum(counts.values()) if counts else None, seed)
+    raise ValueError("unknown sample method %r, expected one of %s" % (method, SAMPLE_METHODS))
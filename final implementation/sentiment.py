@@ -0,0 +1,73 @@
+"""Distributed VADER sentiment scoring for the Amazon review dataset.
+
+The notebook originally pulled 10000 review bodies to the driver and scored
+them one at a time, building a new SentimentIntensityAnalyzer (and reloading
+the lexicon) for every review. Here the scoring runs on the executors as an
+Arrow-backed pandas UDF, so every Python worker scores whole batches of
+reviews and keeps a single analyser for its lifetime.
+"""
+
+import pandas as pd
+
+import pyspark.sql.functions as F
+from pyspark.sql.functions import pandas_udf
+from pyspark.sql.types import DoubleType, StructType, StructField
+
+from common import DEFAULT_THRESHOLD, get_analyser, label_compound
+
+# all four VADER polarity scores of a review
+SCORES_SCHEMA = StructType([StructField(name, DoubleType())
+                            for name in ['compound', 'pos', 'neu', 'neg']])
+
+
+@pandas_udf(DoubleType())
+def vader_compound(review_bodies: pd.Series) -> pd.Series:
+    """Score a batch of review bodies, returning the VADER compound score."""
+    analyser = get_analyser()
+    return review_bodies.map(
+        lambda text: analyser.polarity_scores(text)['compound'] if isinstance(text, str) else None)
+
+
+@pandas_udf(SCORES_SCHEMA)
+def vader_scores(review_bodies: pd.Series) -> pd.DataFrame:
+    """Score a batch of review bodies, returning all four VADER polarity scores."""
+    analyser = get_analyser()
+    empty = {'compound': None, 'pos': None, 'neu': None, 'neg': None}
+    return pd.DataFrame([analyser.polarity_scores(text) if isinstance(text, str) else empty
+                         for text in review_bodies],
+                        columns=['compound', 'pos', 'neu', 'neg'])
+
+
+def sentiment_label_col(compound_col, threshold=DEFAULT_THRESHOLD):
+    """Column expression tagging a compound score column as pos/neu/neg."""
+    return F.when(compound_col >= threshold, 'pos') \
+            .when(compound_col <= -threshold, 'neg') \
+            .when(compound_col.isNotNull(), 'neu')
+
+
+def add_sentiment(df, text_col='review_body', threshold=DEFAULT_THRESHOLD):
+    """Add the VADER 'compound' score and the 'sent_score' tag to every row of df.
+
+    Rows without a review body cannot be analysed, so both columns are NULL for them.
+    """
+    return df.withColumn('compound', vader_compound(F.col(text_col))) \
+             .withColumn('sent_score', sentiment_label_col(F.col('compound'), threshold))
+
+
+# columns that identify a review and its rating in the sentiment analysis dataset
+ANALYSIS_COLUMNS = ['review_id', 'product_id', 'review_body', 'star_rating']
+
+
+def score_reviews(df, text_col='review_body', threshold=DEFAULT_THRESHOLD):
+    """Build the sentiment analysis dataset: one row per review with a review body.
+
+    Every row keeps its review_id, product_id and star_rating next to the
+    'compound' and 'sent_score' columns, so no join is needed to compare the
+    sentiment of a review with its rating. If df was already scored by
+    add_sentiment() its compound scores are reused rather than recomputed.
+    """
+    reviews = df.filter(F.col(text_col).isNotNull())
+    if 'compound' in df.columns:
+        return reviews.select(*ANALYSIS_COLUMNS, 'compound') \
+                      .withColumn('sent_score', sentiment_label_col(F.col('compound'), threshold))
+    return add_sentiment(reviews.select(*ANALYSIS_COLUMNS), text_col, threshold)
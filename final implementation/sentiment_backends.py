@@ -0,0 +1,179 @@
+"""Pluggable sentiment backends and a throughput / accuracy comparison.
+
+Every backend scores a batch of review texts at once with score(texts),
+returning one polarity per text between -1 (negative) and 1 (positive),
+and tags reviews at or beyond its threshold as 'pos' or 'neg' like
+VADER_sentimental_score does. The polarities of the backends are spread
+differently, so every backend has its own default threshold. score_df() adds the same 'compound' and
+'sent_score' columns as sentiment.add_sentiment(), so every backend plugs
+into the confusion matrix of metrics.py.
+
+* VaderBackend: the VADER compound score.
+* TextBlobBackend: TextBlob's pattern-based polarity.
+* LinearModelBackend: hashed TF-IDF and a logistic regression trained with
+  Spark ML on the star ratings (4+ stars positive, 3 neutral, 2- negative),
+  whose score is P(positive) - P(negative). It runs entirely in the JVM.
+
+compare_backends() reports the reviews scored per second per core of every
+backend, and how well their tags agree with the star ratings, at the
+backend's threshold and, given thresholds to sweep, at the best of them.
+"""
+
+import time
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+import pyspark.sql.functions as F
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import pandas_udf
+from pyspark.sql.types import DoubleType
+
+from metrics import confusion_matrix, threshold_sweep
+from sentiment import DEFAULT_THRESHOLD, add_sentiment, get_analyser, label_compound, sentiment_label_col
+
+
+class SentimentBackend(ABC):
+    """Batched sentiment scorer; subclasses implement score()."""
+    name = None
+    default_threshold = DEFAULT_THRESHOLD
+
+    def __init__(self, threshold=None):
+        self.threshold = self.default_threshold if threshold is None else threshold
+
+    @abstractmethod
+    def score(self, texts):
+        """Polarities between -1 and 1 of an iterable of review texts, as a list."""
+
+    def label(self, score):
+        return label_compound(score, self.threshold)
+
+    def score_df(self, df, text_col='review_body'):
+        """Add the 'compound' polarity and the 'sent_score' tag to df, scoring batches on the executors."""
+        backend = self
+
+        @pandas_udf(DoubleType())
+        def score_batch(texts: pd.Series) -> pd.Series:
+            valid = texts.map(lambda text: isinstance(text, str))
+            scores = pd.Series(None, index=texts.index, dtype='float64')
+            if valid.any():
+                scores[valid] = backend.score(texts[valid])
+            return scores
+
+        return df.withColumn('compound', score_batch(F.col(text_col))) \
+                 .withColumn('sent_score', sentiment_label_col(F.col('compound'), self.threshold))
+
+
+class VaderBackend(SentimentBackend):
+    name = 'vader'
+
+    def score(self, texts):
+        analyser = get_analyser()
+        return [analyser.polarity_scores(text)['compound'] for text in texts]
+
+    def score_df(self, df, text_col='review_body'):
+        return add_sentiment(df, text_col, self.threshold)
+
+
+class TextBlobBackend(SentimentBackend):
+    name = 'textblob'
+    # TextBlob averages the polarity of every opinion word, so few reviews get far from 0
+    default_threshold = 0.1
+
+    def score(self, texts):
+        from textblob import TextBlob
+        return [TextBlob(text).sentiment.polarity for text in texts]
+
+
+class LinearModelBackend(SentimentBackend):
+    """Hashed TF-IDF + logistic regression, fit on star ratings with fit()."""
+    name = 'linear'
+    # P(positive) - P(negative), so 'pos' once positive is the clearly more likely class
+    default_threshold = 0.3
+
+    def __init__(self, threshold=None, num_features=1 << 18, reg_param=0.01):
+        super().__init__(threshold)
+        self.num_features = num_features
+        self.reg_param = reg_param
+        self.model = None
+
+    def fit(self, df, text_col='review_body'):
+        """Train on the reviews of df, labelled by their star_rating."""
+        from pyspark.ml import Pipeline
+        from pyspark.ml.classification import LogisticRegression
+        from pyspark.ml.feature import HashingTF, IDF, RegexTokenizer
+
+        # label 0 is negative (2- stars), 1 neutral (3 stars), 2 positive (4+ stars)
+        label = F.when(F.col('star_rating') >= 4, 2.0) \
+                 .when(F.col('star_rating') <= 2, 0.0).otherwise(1.0)
+        training = df.filter(F.col(text_col).isNotNull()) \
+                     .select(F.col(text_col).alias('_text'), label.alias('label'))
+        pipeline = Pipeline(stages=[
+            RegexTokenizer(inputCol='_text', outputCol='_tokens', pattern=r'\W+'),
+            HashingTF(inputCol='_tokens', outputCol='_tf', numFeatures=self.num_features),
+            IDF(inputCol='_tf', outputCol='_features'),
+            LogisticRegression(featuresCol='_features', labelCol='label', family='multinomial',
+                               regParam=self.reg_param, probabilityCol='_probability',
+                               predictionCol='_prediction', rawPredictionCol='_raw'),
+        ])
+        self.model = pipeline.fit(training)
+        return self
+
+    def _transform(self, df, text_col):
+        from pyspark.ml.functions import vector_to_array
+        if self.model is None:
+            raise ValueError("LinearModelBackend must be fit() before scoring")
+        probability = vector_to_array(F.col('_probability'))
+        return self.model.transform(df.withColumn('_text', F.coalesce(F.col(text_col), F.lit('')))) \
+                   .withColumn('compound', F.when(F.col(text_col).isNotNull(),
+                                                  probability[2] - probability[0])) \
+                   .drop('_text', '_tokens', '_tf', '_features', '_raw', '_probability', '_prediction')
+
+    def score(self, texts):
+        # small batches are scored through a driver-side DataFrame; use score_df() for datasets
+        spark = SparkSession.builder.getOrCreate()
+        rows = spark.createDataFrame([(text,) for text in texts], ['_input'])
+        return [row.compound for row in self._transform(rows, '_input').select('compound').collect()]
+
+    def score_df(self, df, text_col='review_body'):
+        return self._transform(df, text_col) \
+                   .withColumn('sent_score', sentiment_label_col(F.col('compound'), self.threshold))
+
+
+def compare_backends(df, backends, text_col='review_body', thresholds=None):
+    """Throughput and agreement with the star ratings of every backend on the reviews of df.
+
+    df should be a cached sample of reviews with a review body and a
+    star_rating. Returns a pandas DataFrame with a row per backend. Given
+    thresholds, every backend is also evaluated at each of them with
+    threshold_sweep(), and its best threshold and accuracy are reported.
+    """
+    spark = df.sql_ctx.sparkSession
+    cores = spark.sparkContext.defaultParallelism
+    rows = df.count()
+    results = []
+    for backend in backends:
+        scored = backend.score_df(df, text_col)
+        start = time.perf_counter()
+        # score every review without moving any rows to the driver
+        scored.write.format('noop').mode('overwrite').save()
+        seconds = time.perf_counter() - start
+
+        confusion = confusion_matrix(scored)
+        metrics = confusion.class_metrics()
+        result = {
+            'backend': backend.name,
+            'reviews': rows,
+            'seconds': seconds,
+            'reviews_per_sec_per_core': rows / seconds / cores if seconds else None,
+            'threshold': backend.threshold,
+            'accuracy': confusion.accuracy(),
+            **{'%s_f1' % sentiment: metrics[sentiment]['f1'] for sentiment in metrics},
+        }
+        if thresholds:
+            sweep = threshold_sweep(scored, thresholds)
+            best = max(sweep, key=lambda threshold: sweep[threshold].accuracy())
+            result['best_threshold'] = best
+            result['best_accuracy'] = sweep[best].accuracy()
+        results.append(result)
+    return pd.DataFrame(results)
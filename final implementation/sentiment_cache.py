@@ -0,0 +1,118 @@
+"""Persistent, content-addressed cache of VADER sentiment scores.
+
+Review bodies are keyed by the SHA-256 hash of their normalised text
+(trimmed, with runs of whitespace collapsed, which doesn't change their
+VADER scores). The cache is a Parquet table of text_hash -> compound, pos,
+neu and neg under
+
+    <cache dir>/version=<lexicon version>/
+
+where the lexicon version is a hash of the VADER lexicon and package
+version, so a new analyser never reads stale scores. score_with_cache()
+only scores the distinct texts missing from the cache, appends them, and
+joins every review to its cached scores. Re-runs and duplicate reviews
+("Love it!", "Beautiful") therefore cost a join instead of a VADER call.
+
+compact_cache() rewrites the current version into fewer files, removes the
+versions of other lexicons, and evicts entries older than max_age_days
+and/or beyond max_entries (oldest scored first).
+"""
+
+import datetime
+import hashlib
+import os
+import shutil
+from importlib import metadata
+
+import pyspark.sql.functions as F
+from pyspark.sql import Window
+
+from sentiment import get_analyser, vader_scores, sentiment_label_col, DEFAULT_THRESHOLD
+
+SCORE_COLUMNS = ['compound', 'pos', 'neu', 'neg']
+
+
+def lexicon_version():
+    """Short hash identifying the installed VADER package and its lexicons."""
+    analyser = get_analyser()
+    digest = hashlib.sha1(metadata.version('vaderSentiment').encode('utf-8'))
+    for lexicon in [analyser.lexicon, analyser.emojis]:
+        digest.update(repr(sorted(lexicon.items())).encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+
+def normalised_text_col(text_col):
+    """The review text, trimmed and with runs of whitespace collapsed to one space."""
+    return F.trim(F.regexp_replace(text_col, r'\s+', ' '))
+
+
+def version_path(cache_dir, version=None):
+    return os.path.join(cache_dir, 'version=%s' % (version or lexicon_version()))
+
+
+def load_cache(spark, cache_dir, version=None):
+    """The cached scores of the current lexicon, or None if nothing is cached yet."""
+    path = version_path(cache_dir, version)
+    if not os.path.exists(path):
+        return None
+    return spark.read.parquet(path)
+
+
+def score_with_cache(df, cache_dir, text_col='review_body', threshold=DEFAULT_THRESHOLD):
+    """Add text_hash, the VADER scores and 'sent_score' to df, scoring only uncached texts.
+
+    Rows without a review body get NULL scores. The scores are joined to
+    every row of df, so a result read more than once should be persisted.
+    """
+    spark = df.sql_ctx.sparkSession
+    version = lexicon_version()
+    path = version_path(cache_dir, version)
+
+    hashed = df.withColumn('text_hash', F.when(
+        F.col(text_col).isNotNull(), F.sha2(normalised_text_col(F.col(text_col)), 256)))
+
+    misses = hashed.filter(F.col('text_hash').isNotNull()) \
+                   .select('text_hash', normalised_text_col(F.col(text_col)).alias('text')) \
+                   .dropDuplicates(['text_hash'])
+    cached = load_cache(spark, cache_dir, version)
+    if cached is not None:
+        misses = misses.join(cached.select('text_hash'), 'text_hash', 'left_anti')
+
+    misses.withColumn('scores', vader_scores(F.col('text'))) \
+          .select('text_hash', *['scores.' + column for column in SCORE_COLUMNS],
+                  F.current_date().alias('scored_at')) \
+          .write.mode('append').parquet(path)
+
+    scores = spark.read.parquet(path).select('text_hash', *SCORE_COLUMNS)
+    return hashed.join(scores, 'text_hash', 'left') \
+                 .withColumn('sent_score', sentiment_label_col(F.col('compound'), threshold))
+
+
+def compact_cache(spark, cache_dir, max_entries=None, max_age_days=None):
+    """Compact the current cache version and evict old entries; returns the entries kept."""
+    version = lexicon_version()
+    current = version_path(cache_dir, version)
+
+    # scores of other lexicon versions can never be read again
+    for name in os.listdir(cache_dir):
+        if name.startswith('version=') and os.path.join(cache_dir, name) != current:
+            shutil.rmtree(os.path.join(cache_dir, name))
+    if not os.path.exists(current):
+        return 0
+
+    # keep the latest score of every hash
+    newest = Window.partitionBy('text_hash').orderBy(F.desc('scored_at'))
+    entries = spark.read.parquet(current) \
+                   .withColumn('_row', F.row_number().over(newest)) \
+                   .filter(F.col('_row') == 1).drop('_row')
+    if max_age_days is not None:
+        oldest = datetime.date.today() - datetime.timedelta(days=max_age_days)
+        entries = entries.filter(F.col('scored_at') >= F.lit(oldest))
+    if max_entries is not None:
+        entries = entries.orderBy(F.desc('scored_at')).limit(max_entries)
+
+    compacted = current + '.compacting'
+    entries.write.mode('overwrite').parquet(compacted)
+    shutil.rmtree(current)
+    os.replace(compacted, current)
+    return spark.read.parquet(current).count()
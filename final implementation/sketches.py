@@ -0,0 +1,327 @@
+"""Approximate analytics with mergeable sketches.
+
+For interactive exploration of the full (and multi-category) datasets, the
+exact distinct counts and percentiles can be replaced by sketches with
+configurable error bounds:
+
+* HyperLogLog for the number of distinct products and customers,
+* a KLL quantile sketch for the number of reviews per product,
+* a count-min sketch of product frequencies that tracks the heavy hitters.
+
+The sketches are built from the per-product and per-customer tables, not
+from the review rows: every product and customer is hashed once, and a
+product is added to the count-min sketch with its number of reviews, so
+the Python work scales with the number of products and customers rather
+than the number of reviews.
+
+Every sketch is built per partition on the executors and merged, and can be
+saved as JSON and merged again later, e.g. across daily partitions or
+categories, without re-scanning the raw reviews. Distinct counts, heavy
+hitters and frequencies merge exactly as if they had been built over the
+union of the data. The review-count quantiles are over the per-product
+counts of each sketched dataset, so they merge exactly across categories
+(whose products don't overlap) but only approximate the quantiles of the
+summed counts when the same products appear in several daily partitions.
+"""
+
+import base64
+import hashlib
+import heapq
+import json
+import math
+import random
+from dataclasses import dataclass
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Distinct count estimate with a relative standard error of about error."""
+
+    def __init__(self, error=0.01, precision=None):
+        if precision is None:
+            precision = math.ceil(math.log2((1.04 / error) ** 2))
+        self.precision = min(max(precision, 4), 18)
+        self.registers = bytearray(1 << self.precision)
+
+    def add(self, value):
+        h = _hash64(value)
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("cannot merge HyperLogLogs of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {"precision": self.precision,
+                "registers": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(precision=data["precision"])
+        sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        return sketch
+
+
+class CountMinSketch:
+    """Frequency estimates within epsilon * total of the true count, with probability 1 - delta.
+
+    The heavy_hitters most frequent values seen are tracked alongside.
+    """
+
+    def __init__(self, epsilon=0.001, delta=0.01, heavy_hitters=20):
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.heavy_hitters = heavy_hitters
+        self.table = [[0] * self.width for _ in range(self.depth)]
+        self.total = 0
+        self.candidates = {}
+
+    def _cells(self, value):
+        digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big")
+        return [(row, (h1 + row * h2) % self.width) for row in range(self.depth)]
+
+    def add(self, value, count=1):
+        cells = self._cells(value)
+        for row, column in cells:
+            self.table[row][column] += count
+        self.total += count
+        self._track(value, min(self.table[row][column] for row, column in cells))
+
+    def _track(self, value, estimate):
+        if value in self.candidates or len(self.candidates) < self.heavy_hitters:
+            self.candidates[value] = estimate
+            return
+        smallest = min(self.candidates, key=self.candidates.get)
+        if estimate > self.candidates[smallest]:
+            del self.candidates[smallest]
+            self.candidates[value] = estimate
+
+    def estimate(self, value):
+        return min(self.table[row][column] for row, column in self._cells(value))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("cannot merge count-min sketches of different dimensions")
+        for row, other_row in zip(self.table, other.table):
+            for column, count in enumerate(other_row):
+                row[column] += count
+        self.total += other.total
+        values = set(self.candidates) | set(other.candidates)
+        estimates = {value: self.estimate(value) for value in values}
+        self.candidates = dict(heapq.nlargest(self.heavy_hitters, estimates.items(),
+                                              key=lambda item: item[1]))
+        return self
+
+    def top(self, k=None):
+        """The heavy hitters as (value, estimated count) pairs, most frequent first."""
+        return sorted(self.candidates.items(), key=lambda item: -item[1])[:k]
+
+    def to_dict(self):
+        return {"width": self.width, "depth": self.depth, "heavy_hitters": self.heavy_hitters,
+                "table": self.table, "total": self.total,
+                "candidates": list(self.candidates.items())}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(heavy_hitters=data["heavy_hitters"])
+        sketch.width, sketch.depth = data["width"], data["depth"]
+        sketch.table = data["table"]
+        sketch.total = data["total"]
+        sketch.candidates = dict((value, count) for value, count in data["candidates"])
+        return sketch
+
+
+class KLLSketch:
+    """Quantile sketch; larger k gives smaller rank error (about 1.7 / k)."""
+
+    def __init__(self, k=200, seed=751):
+        self.k = k
+        self.n = 0
+        self.compactors = [[]]
+        self._random = random.Random(seed)
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(2, int(math.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def _size(self):
+        return sum(len(compactor) for compactor in self.compactors)
+
+    def _max_size(self):
+        return sum(self._capacity(level) for level in range(len(self.compactors)))
+
+    def _compress(self):
+        while self._size() > self._max_size():
+            for level, compactor in enumerate(self.compactors):
+                if len(compactor) >= self._capacity(level):
+                    if level + 1 == len(self.compactors):
+                        self.compactors.append([])
+                    compactor.sort()
+                    # an odd item out stays at this level, so no weight is lost
+                    kept = compactor[-1:] if len(compactor) % 2 else []
+                    pairs = compactor[:len(compactor) - len(kept)]
+                    # keep every other item, which now stands for twice the weight
+                    offset = self._random.randint(0, 1)
+                    self.compactors[level + 1].extend(pairs[offset::2])
+                    self.compactors[level] = kept
+                    break
+
+    def add(self, value):
+        self.compactors[0].append(value)
+        self.n += 1
+        if len(self.compactors[0]) >= self._capacity(0):
+            self._compress()
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, compactor in enumerate(other.compactors):
+            self.compactors[level].extend(compactor)
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantiles(self, fractions):
+        """Approximate values at the given fractions (0 to 1) of the sorted data."""
+        items = sorted((value, 2 ** level)
+                       for level, compactor in enumerate(self.compactors) for value in compactor)
+        if not items:
+            return [None for _ in fractions]
+        total = sum(weight for _, weight in items)
+        results = []
+        for fraction in fractions:
+            target, cumulative = fraction * total, 0
+            for value, weight in items:
+                cumulative += weight
+                if cumulative >= target:
+                    break
+            results.append(value)
+        return results
+
+    def to_dict(self):
+        return {"k": self.k, "n": self.n, "compactors": self.compactors}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(k=data["k"])
+        sketch.n = data["n"]
+        sketch.compactors = data["compactors"]
+        return sketch
+
+
+@dataclass
+class ReviewSketches:
+    """The sketches of a review dataset."""
+    products: HyperLogLog
+    customers: HyperLogLog
+    product_frequencies: CountMinSketch
+    review_count_quantiles: KLLSketch
+
+    def merge(self, other):
+        self.products.merge(other.products)
+        self.customers.merge(other.customers)
+        self.product_frequencies.merge(other.product_frequencies)
+        self.review_count_quantiles.merge(other.review_count_quantiles)
+        return self
+
+    def summary(self, fractions=(0.25, 0.5, 0.75)):
+        """The approximate statistics as a dict."""
+        return {
+            "reviews": self.product_frequencies.total,
+            "distinct_products": self.products.count(),
+            "distinct_customers": self.customers.count(),
+            "review_count_quantiles": dict(zip(fractions,
+                                               self.review_count_quantiles.quantiles(fractions))),
+            "heavy_hitter_products": self.product_frequencies.top(),
+        }
+
+    def save(self, path):
+        with open(path, "w") as sketch_file:
+            json.dump({"products": self.products.to_dict(),
+                       "customers": self.customers.to_dict(),
+                       "product_frequencies": self.product_frequencies.to_dict(),
+                       "review_count_quantiles": self.review_count_quantiles.to_dict()},
+                      sketch_file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as sketch_file:
+            data = json.load(sketch_file)
+        return cls(HyperLogLog.from_dict(data["products"]),
+                   HyperLogLog.from_dict(data["customers"]),
+                   CountMinSketch.from_dict(data["product_frequencies"]),
+                   KLLSketch.from_dict(data["review_count_quantiles"]))
+
+
+def load_merged(paths):
+    """Load and merge the sketches saved at every path."""
+    sketches = None
+    for path in paths:
+        loaded = ReviewSketches.load(path)
+        sketches = loaded if sketches is None else sketches.merge(loaded)
+    return sketches
+
+
+def sketch_products(product_counts, error=0.01, epsilon=0.001, delta=0.01, heavy_hitters=20, k=200):
+    """The distinct product, product frequency and review-count quantile sketches of a product table.
+
+    product_counts has a row per product with its product_id and
+    product_reviews, such as ReviewReport.product_reviews. Returns
+    (products HyperLogLog, CountMinSketch, KLLSketch).
+    """
+    def sketch_rows(rows):
+        products = HyperLogLog(error)
+        frequencies = CountMinSketch(epsilon, delta, heavy_hitters)
+        quantiles = KLLSketch(k)
+        for product_id, reviews in rows:
+            products.add(product_id)
+            frequencies.add(product_id, reviews)
+            quantiles.add(reviews)
+        yield products, frequencies, quantiles
+
+    def merge(left, right):
+        return tuple(a.merge(b) for a, b in zip(left, right))
+
+    return product_counts.select("product_id", "product_reviews").rdd \
+        .mapPartitions(sketch_rows).treeReduce(merge)
+
+
+def sketch_customers(customer_counts, error=0.01):
+    """The distinct customer HyperLogLog of a table with a row per customer_id, such as ReviewReport.customer_reviews."""
+    def sketch_rows(rows):
+        customers = HyperLogLog(error)
+        for row in rows:
+            customers.add(row[0])
+        yield customers
+
+    return customer_counts.select("customer_id").rdd \
+        .mapPartitions(sketch_rows).treeReduce(lambda a, b: a.merge(b))
+
+
+def sketch_reviews(product_counts, customer_counts, error=0.01, epsilon=0.001, delta=0.01,
+                   heavy_hitters=20, k=200):
+    """Build the ReviewSketches of a review dataset from its per-product and per-customer tables."""
+    products, frequencies, quantiles = sketch_products(product_counts, error, epsilon, delta,
+                                                       heavy_hitters, k)
+    return ReviewSketches(products, sketch_customers(customer_counts, error), frequencies, quantiles)
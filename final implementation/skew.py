@@ -0,0 +1,119 @@
+"""Skew-aware aggregation for hot products and power-reviewer customers.
+
+A few product_ids and customer_ids own a large share of the reviews, so a
+plain groupBy sends all of their rows to one task each and leaves those
+tasks running long after the rest. hot_keys() estimates the key frequencies
+from a sample, and salted_aggregate() spreads the rows of the hot keys over
+several salt buckets, aggregates every (key, salt) pair, then merges the
+partial results of each key. Cold keys keep a single bucket, so they cost
+no extra rows in the merge.
+
+The number of shuffle partitions is picked from the size of the input
+instead of being fixed, and skew_stats() / partition_stats() report how
+uneven the keys and the partitions of a stage are. count_stats() reports the
+same from a table that already holds a count per key, such as
+product_reviews, without grouping the rows again.
+"""
+
+import math
+from dataclasses import dataclass
+
+import pyspark.sql.functions as F
+
+from profiling import to_driver
+
+# aim for shuffle partitions of about this many input bytes
+TARGET_PARTITION_BYTES = 128 * 1024 * 1024
+MAX_SHUFFLE_PARTITIONS = 2000
+
+
+def input_size(spark, path):
+    """Total size in bytes of the files under path, on any Hadoop filesystem."""
+    jvm = spark.sparkContext._jvm
+    hadoop_path = jvm.org.apache.hadoop.fs.Path(path)
+    fs = hadoop_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+    return fs.getContentSummary(hadoop_path).getLength()
+
+
+def choose_shuffle_partitions(input_bytes, parallelism, target_bytes=TARGET_PARTITION_BYTES):
+    """Number of shuffle partitions for an input of input_bytes on parallelism cores."""
+    partitions = math.ceil(input_bytes / target_bytes)
+    return min(max(partitions, parallelism), MAX_SHUFFLE_PARTITIONS)
+
+
+def configure_shuffle_partitions(spark, path, target_bytes=TARGET_PARTITION_BYTES):
+    """Set spark.sql.shuffle.partitions from the size of the input at path, and return it."""
+    partitions = choose_shuffle_partitions(input_size(spark, path),
+                                           spark.sparkContext.defaultParallelism, target_bytes)
+    spark.conf.set("spark.sql.shuffle.partitions", str(partitions))
+    return partitions
+
+
+def hot_keys(df, key, fraction=0.01, hot_share=None, seed=751):
+    """Estimate the keys of df owning a disproportionate share of its rows.
+
+    A key is hot when its estimated share of the rows is at least hot_share,
+    which defaults to the share of one shuffle partition. Returns a dict of
+    hot key -> estimated number of rows.
+    """
+    if hot_share is None:
+        hot_share = 1.0 / int(df.sql_ctx.getConf("spark.sql.shuffle.partitions", "200"))
+    sample = df.select(key).sample(fraction=fraction, seed=seed)
+    counts = sample.groupBy(key).count().cache()
+    sampled_rows = counts.agg(F.sum("count")).first()[0] or 0
+    hot = to_driver(counts.filter(F.col("count") >= hot_share * sampled_rows).collect())
+    counts.unpersist()
+    return {row[key]: int(row["count"] / fraction) for row in hot}
+
+
+def salted_aggregate(df, key, aggregations, hot, buckets=16, seed=751):
+    """Aggregate df by key, splitting each hot key over buckets partial aggregates.
+
+    aggregations are aliased count or sum expressions; since those add up,
+    the partial results of each key are merged by summing them. hot is a
+    collection of hot keys, such as the result of hot_keys().
+    """
+    if not hot:
+        return df.groupBy(key).agg(*aggregations)
+    salt = F.when(F.col(key).isin(list(hot)), F.floor(F.rand(seed) * buckets)).otherwise(0)
+    partial = df.withColumn("_salt", salt).groupBy(key, "_salt").agg(*aggregations)
+    columns = [column for column in partial.columns if column not in (key, "_salt")]
+    return partial.groupBy(key).agg(*[F.sum(column).alias(column) for column in columns])
+
+
+@dataclass
+class SkewStats:
+    """How unevenly the rows of a stage are spread over its keys and partitions."""
+    stage: str
+    keys: int
+    rows: int
+    max_rows: int
+    mean_rows: float
+    median_rows: float
+    # share of all rows owned by the largest key or partition
+    top_share: float
+
+    @property
+    def skew_ratio(self):
+        """Rows of the largest key or partition over the mean; 1.0 is perfectly even."""
+        return self.max_rows / self.mean_rows if self.mean_rows else 0.0
+
+
+def count_stats(counts, column, stage):
+    """Skew of a table holding the number of rows of every key in column, e.g. product_reviews."""
+    summary = counts.agg(F.count(F.lit(1)), F.sum(column), F.max(column), F.avg(column),
+                         F.expr("percentile_approx(%s, 0.5)" % column)).first()
+    keys, rows, max_rows, mean_rows, median_rows = summary
+    return SkewStats(stage, keys, rows or 0, max_rows or 0, mean_rows or 0.0,
+                     median_rows or 0.0, (max_rows or 0) / rows if rows else 0.0)
+
+
+def skew_stats(df, key, stage=None):
+    """Skew of the number of rows per key of df."""
+    return count_stats(df.groupBy(key).count(), "count", stage or key)
+
+
+def partition_stats(df, stage="partitions"):
+    """Skew of the number of rows per partition of df, e.g. the output of a shuffle."""
+    counts = df.groupBy(F.spark_partition_id().alias("partition")).count()
+    return count_stats(counts, "count", stage)
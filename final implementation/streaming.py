@@ -0,0 +1,130 @@
+"""Structured Streaming mode for near-real-time product sentiment dashboards.
+
+Review TSV files dropped into a local directory are picked up by the file
+source (no external broker needed), parsed with the fixed review schema,
+cleaned and scored with the same VADER analysis as the batch notebook. Per
+product and per review_date window the stream maintains the number of
+reviews, positive and negative reviews, the average star rating and the mix
+of sentiment tags.
+
+The aggregation runs in update mode with a watermark on review_date, so
+Spark drops the state of windows once they are older than the watermark
+and every micro-batch only emits the windows it changed. Those updates go
+either to a Parquet directory or to an in-memory ProductDashboard on the
+driver, which answers questions like "highest positives" within seconds of
+a review arriving.
+
+Usage: streaming.py <input dir> <parquet output dir> <checkpoint dir>
+"""
+
+import heapq
+import sys
+
+import pyspark.sql.functions as F
+from pyspark.sql import SparkSession
+
+from aggregates import POSITIVE_RATING, NEGATIVE_RATING, count_if
+from ingest import REVIEW_SCHEMA, clean_reviews
+from sentiment import add_sentiment, DEFAULT_THRESHOLD
+
+WINDOW_KEYS = ["window_start", "window_end", "product_id"]
+
+
+def review_stream(spark, input_dir, max_files_per_trigger=None):
+    """Stream the cleaned reviews of the TSV files landing in input_dir."""
+    reader = spark.readStream.schema(REVIEW_SCHEMA) \
+                  .option("sep", "\t") \
+                  .option("header", True)
+    if max_files_per_trigger:
+        reader = reader.option("maxFilesPerTrigger", max_files_per_trigger)
+    return clean_reviews(reader.csv(input_dir))
+
+
+def product_windows(reviews, window_duration="1 day", watermark="2 days",
+                    threshold=DEFAULT_THRESHOLD):
+    """Windowed per-product rating and sentiment aggregates of a review stream."""
+    rating = F.col("star_rating")
+    sentiment = F.col("sent_score")
+    return add_sentiment(reviews, threshold=threshold) \
+        .withColumn("event_time", F.to_timestamp("review_date")) \
+        .withWatermark("event_time", watermark) \
+        .groupBy(F.window("event_time", window_duration), "product_id") \
+        .agg(F.count(F.lit(1)).alias("product_reviews"),
+             count_if(rating >= POSITIVE_RATING).alias("positive_reviews"),
+             count_if(rating <= NEGATIVE_RATING).alias("negative_reviews"),
+             F.avg(rating).alias("avg_star_rating"),
+             count_if(sentiment == 'pos').alias("pos_sentiment"),
+             count_if(sentiment == 'neu').alias("neu_sentiment"),
+             count_if(sentiment == 'neg').alias("neg_sentiment")) \
+        .select(F.col("window.start").alias("window_start"),
+                F.col("window.end").alias("window_end"),
+                "product_id", "product_reviews", "positive_reviews", "negative_reviews",
+                "avg_star_rating", "pos_sentiment", "neu_sentiment", "neg_sentiment")
+
+
+class ProductDashboard:
+    """Latest windowed aggregates of every product, kept in driver memory.
+
+    Only windows ending within retention of the newest window are kept, so
+    the dashboard stays as small as the streaming state.
+    """
+
+    def __init__(self, retention):
+        # retention is a datetime.timedelta
+        self.retention = retention
+        self.rows = {}
+
+    def update(self, batch_df, batch_id):
+        # foreachBatch callback: update-mode batches only hold changed windows
+        for row in batch_df.collect():
+            record = row.asDict()
+            self.rows[tuple(record[key] for key in WINDOW_KEYS)] = record
+        if self.rows:
+            newest = max(key[1] for key in self.rows)
+            self.rows = {key: record for key, record in self.rows.items()
+                         if key[1] >= newest - self.retention}
+
+    def highest(self, column, k=5):
+        """The k (window, product) rows with the highest value of column."""
+        return heapq.nlargest(k, self.rows.values(), key=lambda record: record[column])
+
+    def to_pandas(self):
+        import pandas as pd
+        return pd.DataFrame(list(self.rows.values()))
+
+
+def start_stream(windows, checkpoint_dir, output_dir=None, dashboard=None,
+                 trigger="5 seconds", query_name="product_sentiment"):
+    """Start writing the updates of windows to output_dir (Parquet) and/or a ProductDashboard."""
+    def write_batch(batch_df, batch_id):
+        batch_df.persist()
+        if output_dir is not None:
+            # every batch appends the windows it changed; the newest batch_id of a window is current
+            batch_df.withColumn("batch_id", F.lit(batch_id)) \
+                    .write.mode("append").parquet(output_dir)
+        if dashboard is not None:
+            dashboard.update(batch_df, batch_id)
+        batch_df.unpersist()
+
+    return windows.writeStream \
+                  .queryName(query_name) \
+                  .outputMode("update") \
+                  .option("checkpointLocation", checkpoint_dir) \
+                  .trigger(processingTime=trigger) \
+                  .foreachBatch(write_batch) \
+                  .start()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("Usage: streaming <input dir> <parquet output dir> <checkpoint dir>", file=sys.stderr)
+        sys.exit(-1)
+
+    spark = SparkSession\
+        .builder\
+        .appName("Streaming Amazon Review Analysis")\
+        .getOrCreate()
+
+    query = start_stream(product_windows(review_stream(spark, sys.argv[1])),
+                         sys.argv[3], output_dir=sys.argv[2])
+    query.awaitTermination()
@@ -0,0 +1,182 @@
+"""Error bounds, merges and serialisation of the sketches in sketches.py.
+
+Run with: python -m pytest test_sketches.py
+"""
+
+import json
+import math
+import random
+from collections import Counter
+
+from sketches import HyperLogLog, CountMinSketch, KLLSketch, ReviewSketches
+
+
+def roundtrip(sketch):
+    return type(sketch).from_dict(json.loads(json.dumps(sketch.to_dict())))
+
+
+def rank_error(values, estimate, fraction):
+    """How far the rank of estimate in the sorted values is from fraction, as a share of all values."""
+    below = sum(1 for value in values if value < estimate)
+    at_or_below = sum(1 for value in values if value <= estimate)
+    target = fraction * len(values)
+    if below <= target <= at_or_below:
+        return 0.0
+    return min(abs(below - target), abs(at_or_below - target)) / len(values)
+
+
+def test_hyperloglog_error_bound():
+    sketch = HyperLogLog(error=0.01)
+    for value in range(100000):
+        sketch.add("P%d" % value)
+    # three standard errors
+    assert abs(sketch.count() - 100000) <= 3 * 1.04 / math.sqrt(len(sketch.registers)) * 100000
+
+
+def test_hyperloglog_small_cardinality():
+    sketch = HyperLogLog(error=0.01)
+    for value in range(100):
+        sketch.add(value)
+        sketch.add(value)
+    assert abs(sketch.count() - 100) <= 2
+
+
+def test_hyperloglog_merge_equals_union():
+    left, right, union = HyperLogLog(0.02), HyperLogLog(0.02), HyperLogLog(0.02)
+    for value in range(30000):
+        (left if value < 20000 else right).add(value)
+        union.add(value)
+    # overlapping values count once
+    for value in range(10000, 20000):
+        right.add(value)
+    assert left.merge(right).registers == union.registers
+
+
+def test_hyperloglog_roundtrip():
+    sketch = HyperLogLog(0.02)
+    for value in range(5000):
+        sketch.add(value)
+    restored = roundtrip(sketch)
+    assert restored.registers == sketch.registers
+    assert restored.count() == sketch.count()
+
+
+def zipf_counts(values=5000, seed=751):
+    rng = random.Random(seed)
+    return {"B%d" % value: max(1, int(10000 / (value + 1) ** 1.1) + rng.randint(0, 3))
+            for value in range(values)}
+
+
+def test_count_min_error_bound():
+    counts = zipf_counts()
+    sketch = CountMinSketch(epsilon=0.001, delta=0.01, heavy_hitters=10)
+    for value, count in counts.items():
+        sketch.add(value, count)
+    total = sum(counts.values())
+    assert sketch.total == total
+    over = [sketch.estimate(value) - count for value, count in counts.items()]
+    assert min(over) >= 0
+    # within epsilon * total, except for a delta share of the values
+    assert sum(1 for error in over if error > 0.001 * total) <= 0.01 * len(counts)
+
+
+def test_count_min_heavy_hitters():
+    counts = zipf_counts()
+    sketch = CountMinSketch(heavy_hitters=10)
+    for value, count in counts.items():
+        sketch.add(value, count)
+    expected = [value for value, _ in Counter(counts).most_common(10)]
+    assert [value for value, _ in sketch.top()] == expected
+
+
+def test_count_min_merge_equals_union():
+    counts = zipf_counts()
+    left, right, union = CountMinSketch(heavy_hitters=10), CountMinSketch(heavy_hitters=10), \
+        CountMinSketch(heavy_hitters=10)
+    for i, (value, count) in enumerate(counts.items()):
+        (left if i % 2 else right).add(value, count)
+        union.add(value, count)
+    merged = left.merge(right)
+    assert merged.table == union.table
+    assert merged.total == union.total
+    assert [value for value, _ in merged.top()] == [value for value, _ in union.top()]
+
+
+def test_count_min_roundtrip():
+    sketch = CountMinSketch(heavy_hitters=5)
+    for value, count in zipf_counts(500).items():
+        sketch.add(value, count)
+    restored = roundtrip(sketch)
+    assert restored.table == sketch.table
+    assert restored.top() == sketch.top()
+    assert restored.estimate("B0") == sketch.estimate("B0")
+
+
+def test_kll_rank_error():
+    rng = random.Random(751)
+    values = [rng.lognormvariate(2, 1.5) for _ in range(50000)]
+    sketch = KLLSketch(k=200)
+    for value in values:
+        sketch.add(value)
+    fractions = [0.1, 0.25, 0.5, 0.75, 0.9]
+    ordered = sorted(values)
+    for fraction, estimate in zip(fractions, sketch.quantiles(fractions)):
+        assert rank_error(ordered, estimate, fraction) <= 0.02
+
+
+def test_kll_keeps_all_weight():
+    sketch = KLLSketch(k=50)
+    for value in range(10001):
+        sketch.add(value)
+    weight = sum(len(compactor) * 2 ** level for level, compactor in enumerate(sketch.compactors))
+    assert sketch.n == 10001
+    assert weight == 10001
+
+
+def test_kll_merge():
+    rng = random.Random(7)
+    values = [rng.random() for _ in range(40000)]
+    left, right = KLLSketch(k=200), KLLSketch(k=200)
+    for i, value in enumerate(values):
+        (left if i % 3 else right).add(value)
+    merged = left.merge(right)
+    assert merged.n == len(values)
+    ordered = sorted(values)
+    for fraction, estimate in zip([0.25, 0.5, 0.75], merged.quantiles([0.25, 0.5, 0.75])):
+        assert rank_error(ordered, estimate, fraction) <= 0.02
+
+
+def test_kll_roundtrip():
+    sketch = KLLSketch(k=100)
+    for value in range(5000):
+        sketch.add(value)
+    restored = roundtrip(sketch)
+    assert restored.n == sketch.n
+    assert restored.quantiles([0.5]) == sketch.quantiles([0.5])
+
+
+def test_review_sketches_save_load_merge(tmp_path):
+    def build(products):
+        sketches = ReviewSketches(HyperLogLog(0.02), HyperLogLog(0.02), CountMinSketch(), KLLSketch())
+        for product, reviews in products.items():
+            sketches.products.add(product)
+            sketches.product_frequencies.add(product, reviews)
+            sketches.review_count_quantiles.add(reviews)
+            for customer in range(reviews):
+                sketches.customers.add("%s-%d" % (product, customer % 7))
+        return sketches
+
+    counts = zipf_counts(2000)
+    first = {value: count for value, count in counts.items() if int(value[1:]) % 2}
+    second = {value: count for value, count in counts.items() if not int(value[1:]) % 2}
+    build(first).save(str(tmp_path / "first.json"))
+    build(second).save(str(tmp_path / "second.json"))
+
+    merged = ReviewSketches.load(str(tmp_path / "first.json")) \
+        .merge(ReviewSketches.load(str(tmp_path / "second.json")))
+    whole = build(counts)
+    summary = merged.summary()
+    assert summary["reviews"] == sum(counts.values())
+    assert summary["distinct_products"] == whole.products.count()
+    assert summary["distinct_customers"] == whole.customers.count()
+    assert merged.product_frequencies.table == whole.product_frequencies.table
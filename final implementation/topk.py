@@ -0,0 +1,79 @@
+"""Distributed top-K rankings without a global sort.
+
+Sorting every product or customer just to keep the first few rows shuffles
+the whole table. top_k() expresses the ranking as orderBy().limit(), which
+Spark plans as TakeOrderedAndProject: every partition keeps a bounded heap of
+its k best rows and only those heaps are merged. top_k_many() does the same
+for several ranking columns at once, so one scan of the table ranks it by
+e.g. total, positive and negative reviews together. Given a group column, it
+keeps the heaps of every group apart, so the rankings of e.g. every category
+also come from that one scan, without a window over the sorted groups.
+"""
+
+import heapq
+
+import pyspark.sql.functions as F
+from pyspark.sql.types import StructType, StructField, StringType, IntegerType
+
+from profiling import to_driver
+
+
+def top_k(df, column, k):
+    """Return the k rows of df with the highest values of column, as a DataFrame."""
+    return df.orderBy(F.desc(column)).limit(k)
+
+
+def top_k_many(df, columns, k, key="product_id", group=None):
+    """Rank df by several columns in a single pass over its partitions.
+
+    Returns a DataFrame with the columns ranking (the name of the ranking
+    column), rank (1 for the highest value), key and value, holding the k
+    highest rows of every ranking column. Rows whose ranking value is NULL
+    are not ranked. With a group column, the k highest rows of every value
+    of group are ranked separately, and the group column comes first.
+    """
+    columns = list(columns)
+    selected = [group, key] if group else [key]
+
+    def partition_heaps(rows):
+        # one bounded min-heap of (value, key) per group and ranking column
+        groups = {}
+        for row in rows:
+            group_value = row[group] if group else None
+            heaps = groups.get(group_value)
+            if heaps is None:
+                heaps = groups[group_value] = [[] for _ in columns]
+            for heap, column in zip(heaps, columns):
+                if row[column] is None:
+                    continue
+                item = (row[column], row[key])
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+        yield groups
+
+    def merge_groups(left, right):
+        merged = dict(left)
+        for group_value, heaps in right.items():
+            if group_value in merged:
+                heaps = [heapq.nlargest(k, a + b) for a, b in zip(merged[group_value], heaps)]
+            merged[group_value] = heaps
+        return merged
+
+    groups = df.select(*selected, *columns).rdd \
+               .mapPartitions(partition_heaps) \
+               .treeAggregate({}, merge_groups, merge_groups)
+
+    rows = to_driver([((group_value,) if group else ()) + (column, rank, item[1], item[0])
+                      for group_value, heaps in groups.items()
+                      for column, heap in zip(columns, heaps)
+                      for rank, item in enumerate(sorted(heap, reverse=True), 1)])
+    group_fields = [StructField(group, df.schema[group].dataType)] if group else []
+    schema = StructType(group_fields + [
+        StructField("ranking", StringType()),
+        StructField("rank", IntegerType()),
+        StructField(key, df.schema[key].dataType),
+        StructField("value", df.schema[columns[0]].dataType),
+    ])
+    return df.sql_ctx.createDataFrame(rows, schema)
@@ -0,0 +1,181 @@
+"""Rating and sentiment trends over time, built from daily rollups.
+
+daily_rollups() scans the cleaned reviews once and counts, for every
+product and review_date, the reviews, the sum of their star ratings, the
+positive and negative reviews and (for scored reviews) the reviews of every
+sentiment tag. All of these are sums, so the weekly, monthly and yearly
+levels are derived by rollup() from the daily table with date_trunc, and
+never from the raw review rows. The daily rollups are written partitioned
+by year, so range queries only read the years they cover.
+
+On top of any level:
+
+* with_rates() adds the average star rating and the positive / negative
+  and sentiment shares of every period,
+* overall() sums the products into a single trend,
+* rolling_average() adds the average star rating over the last few periods
+  (calendar periods, so a month without reviews still counts as one),
+* top_movers() finds the products whose negative share rose the most from
+  one period to the next.
+
+Usage: trends.py <cleaned reviews parquet> <daily rollups output dir>
+"""
+
+import sys
+
+import pyspark.sql.functions as F
+from pyspark.sql import SparkSession, Window
+
+from aggregates import count_if, POSITIVE_RATING, NEGATIVE_RATING
+from metrics import SENTIMENTS
+
+LEVELS = ["day", "week", "month", "year"]
+SENTIMENT_COLUMNS = ["%s_sentiment" % label for label in SENTIMENTS]
+
+
+def count_columns(df):
+    """The additive count columns of a rollup table."""
+    columns = ["reviews", "star_sum", "positive_reviews", "negative_reviews"]
+    return columns + [column for column in SENTIMENT_COLUMNS if column in df.columns]
+
+
+def daily_rollups(df):
+    """Per-product, per-day counts of the cleaned reviews df.
+
+    The sentiment counts are included when df has a 'sent_score' column.
+    """
+    rating = F.col("star_rating")
+    aggregations = [F.count(F.lit(1)).alias("reviews"),
+                    F.sum(rating).alias("star_sum"),
+                    count_if(rating >= POSITIVE_RATING).alias("positive_reviews"),
+                    count_if(rating <= NEGATIVE_RATING).alias("negative_reviews")]
+    if "sent_score" in df.columns:
+        aggregations += [count_if(F.col("sent_score") == label).alias("%s_sentiment" % label)
+                         for label in SENTIMENTS]
+    return df.filter(F.col("review_date").isNotNull()) \
+             .groupBy(F.col("review_date").alias("period"), "product_id") \
+             .agg(*aggregations) \
+             .withColumn("year", F.year("period"))
+
+
+def write_daily(daily, path):
+    """Write the daily rollups partitioned by year."""
+    daily.repartition("year").write.mode("overwrite").partitionBy("year").parquet(path)
+
+
+def load_daily(spark, path):
+    return spark.read.parquet(path)
+
+
+def date_range(rollups, start=None, end=None):
+    """The rows of rollups with a period from start to end (inclusive, datetime.date or None)."""
+    if start is not None:
+        rollups = rollups.filter((F.col("year") >= start.year) & (F.col("period") >= F.lit(start)))
+    if end is not None:
+        rollups = rollups.filter((F.col("year") <= end.year) & (F.col("period") <= F.lit(end)))
+    return rollups
+
+
+def rollup(daily, level="month"):
+    """Sum the daily rollups into periods of a level ('day', 'week', 'month' or 'year')."""
+    if level not in LEVELS:
+        raise ValueError("unknown level %r, expected one of %s" % (level, LEVELS))
+    if level == "day":
+        return daily
+    period = F.to_date(F.date_trunc(level, F.col("period")))
+    return daily.groupBy(period.alias("period"), "product_id") \
+                .agg(*[F.sum(column).alias(column) for column in count_columns(daily)]) \
+                .withColumn("year", F.year("period"))
+
+
+def overall(rollups):
+    """Sum the products of rollups into one row per period."""
+    return rollups.groupBy("period", "year") \
+                  .agg(*[F.sum(column).alias(column) for column in count_columns(rollups)])
+
+
+def with_rates(rollups):
+    """Add the average star rating, the positive / negative shares and the sentiment shares."""
+    reviews = F.col("reviews")
+    rates = rollups.withColumn("avg_star_rating", F.col("star_sum") / reviews) \
+                   .withColumn("positive_share", F.col("positive_reviews") / reviews) \
+                   .withColumn("negative_share", F.col("negative_reviews") / reviews)
+    sentiments = [column for column in SENTIMENT_COLUMNS if column in rollups.columns]
+    if sentiments:
+        scored = sum(F.col(column) for column in sentiments)
+        for column in sentiments:
+            rates = rates.withColumn(column.replace("_sentiment", "_share"), F.col(column) / scored)
+    return rates
+
+
+def period_index(level):
+    """Column numbering the periods of a level consecutively, e.g. months since year 0."""
+    if level not in LEVELS:
+        raise ValueError("unknown level %r, expected one of %s" % (level, LEVELS))
+    period = F.col("period")
+    if level == "month":
+        return F.year(period) * 12 + F.month(period)
+    elif level == "year":
+        return F.year(period)
+    days = F.datediff(period, F.to_date(F.lit("1970-01-01")))
+    # weeks start on Mondays, exactly 7 days apart
+    return F.floor(days / 7) if level == "week" else days
+
+
+def rolling_average(rollups, periods=3, key="product_id", level="month"):
+    """Add the average star rating of the last periods periods (of every key, if key is given).
+
+    The window covers calendar periods of the rollups' level, not rows, so
+    periods without reviews shorten it instead of pulling in older ones.
+    """
+    index = period_index(level)
+    window = (Window.partitionBy(key).orderBy(index) if key else Window.orderBy(index)) \
+        .rangeBetween(1 - periods, 0)
+    return rollups.withColumn("rolling_avg_star_rating",
+                              F.sum("star_sum").over(window) / F.sum("reviews").over(window))
+
+
+def top_movers(rollups, n=10, measure="negative_share", min_reviews=10, level="month"):
+    """The n products whose measure rose the most from their previous period.
+
+    rollups is the given level of the daily rollups (e.g. rollup(daily,
+    "month"), possibly restricted with date_range()). Every period is
+    compared with the calendar period right before it, and only when both
+    have at least min_reviews reviews, so a single bad review doesn't count
+    as a spike. A product without reviews in the period before isn't
+    compared with an older one. measure is any share added by with_rates(),
+    such as 'negative_share' (1 and 2 star reviews) or 'neg_share' (reviews
+    tagged 'neg').
+    """
+    previous = Window.partitionBy("product_id").orderBy("period")
+    return with_rates(rollups) \
+        .withColumn("period_index", period_index(level)) \
+        .withColumn("previous_index", F.lag("period_index").over(previous)) \
+        .withColumn("previous_period", F.lag("period").over(previous)) \
+        .withColumn("previous_reviews", F.lag("reviews").over(previous)) \
+        .withColumn("previous_" + measure, F.lag(measure).over(previous)) \
+        .filter(F.col("period_index") - F.col("previous_index") == 1) \
+        .filter((F.col("reviews") >= min_reviews) & (F.col("previous_reviews") >= min_reviews)) \
+        .withColumn("change", F.col(measure) - F.col("previous_" + measure)) \
+        .filter(F.col("change").isNotNull()) \
+        .orderBy(F.desc("change")) \
+        .limit(n) \
+        .select("product_id", "previous_period", "period", "previous_" + measure, measure,
+                "change", "reviews")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: trends <cleaned reviews parquet> <daily rollups output dir>", file=sys.stderr)
+        sys.exit(-1)
+
+    spark = SparkSession\
+        .builder\
+        .appName("Amazon Review Trends")\
+        .getOrCreate()
+
+    write_daily(daily_rollups(spark.read.parquet(sys.argv[1])), sys.argv[2])
+    monthly = with_rates(overall(rollup(load_daily(spark, sys.argv[2]), "month")))
+    monthly.orderBy("period").select("period", "reviews", "avg_star_rating", "negative_share").show(24)
+
+    spark.stop()
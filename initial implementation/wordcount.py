@@ -15,15 +15,58 @@
 # limitations under the License.
 #
 
+"""Word count over a text file, matching the Hadoop WordCount in mapreduce.java.
+
+Words are split on the same whitespace characters as Java's StringTokenizer
+and counted with a DataFrame explode(split()) aggregation, so the words stay
+in the JVM instead of being pickled through Python one at a time. Spark
+sums the counts of every partition before the shuffle, like the
+IntSumReducer combiner of the Java job.
+
+The counts are written as "word<TAB>count" text files to the output
+directory, like Hadoop's TextOutputFormat, without collecting them on the
+driver. With --top N the N most frequent words are printed instead (or as
+well); Spark keeps a bounded heap per partition for this rather than
+sorting every word.
+"""
+
+import argparse
 import sys
-from operator import add
 
+import pyspark.sql.functions as F
 from pyspark.sql import SparkSession
 
+# the delimiters of java.util.StringTokenizer
+DELIMITERS = r"[ \t\n\r\f]+"
+
+
+def word_counts(spark, path):
+    """DataFrame of (word, count) for every word of the text file(s) at path."""
+    words = spark.read.text(path) \
+                 .select(F.explode(F.split(F.col("value"), DELIMITERS)).alias("word")) \
+                 .filter(F.col("word") != "")
+    return words.groupBy("word").count()
+
+
+def write_counts(counts, output):
+    """Write the counts as word<TAB>count lines, one file per partition."""
+    counts.select(F.concat_ws("\t", "word", F.col("count").cast("string"))) \
+          .write.text(output)
+
+
+def top_words(counts, n):
+    """The n most frequent words and their counts, as a list of rows."""
+    return counts.orderBy(F.desc("count")).limit(n).collect()
+
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: wordcount <file>", file=sys.stderr)
+    parser = argparse.ArgumentParser(prog="wordcount")
+    parser.add_argument("file")
+    parser.add_argument("output", nargs="?", help="directory to write the counts to")
+    parser.add_argument("--top", type=int, metavar="N", help="print the N most frequent words")
+    args = parser.parse_args()
+    if args.output is None and args.top is None:
+        print("Usage: wordcount <file> [<output dir>] [--top N]", file=sys.stderr)
         sys.exit(-1)
 
     # Initiate a Spark Application titled PythonWordCount
@@ -33,16 +76,15 @@ if __name__ == "__main__":
         .appName("PythonWordCount")\
         .getOrCreate()
 
-    # Obtain the lines from the file
-    lines = spark.read.text(sys.argv[1]).rdd.map(lambda r: r[0])
+    # Count the words of the file
+    counts = word_counts(spark, args.file)
 
-    counts = lines.flatMap(lambda x: x.split(' ')) \
-                  .map(lambda x: (x, 1)) \
-                  .reduceByKey(add)
-    output = counts.collect()
+    if args.output is not None:
+        write_counts(counts, args.output)
 
-    for (word, count) in output:
-        print("%s: %i" % (word, count))
+    if args.top is not None:
+        for (word, count) in top_words(counts, args.top):
+            print("%s: %i" % (word, count))
 
     # Exit application
-    spark.stop()
\ No newline at end of file
+    spark.stop()